@@ -10,10 +10,87 @@ import uvloop
 from misc import logger
 from mqtt_client import Client
 from manager import Manager
+from router import Router
+from dispatcher import Dispatcher
+from devices.icmp import ping_cache
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
+def make_router(manager: Manager, client: Client, dispatcher: Dispatcher) -> Router:
+    router = Router(dispatcher)
+
+    def device_key(segments, _):
+        device = manager.devices_by_name.get(segments[1])
+        return ('devices', device.id if device is not None else segments[1])
+
+    def data_key(type):
+        def key(_, payload):
+            return (type, payload['data']['id'])
+        return key
+
+    @router.route('probe/+/+', parse_json=False, key=device_key)
+    async def probe(segments, payload):
+        _, fqdn, device_method = segments
+        device = manager.devices_by_name.get(fqdn)
+        if device is None:
+            message = f'Device not subscribed: {fqdn}'
+            json_payload = json.dumps({
+                'error': {
+                    'message': message,
+                    'time': time.time() * 1000
+                }
+            })
+            await client.publish('manager/device_event', json_payload)
+            logger.error(message)
+            return
+        method = getattr(device, f'on_{device_method}')
+        await method(payload)
+
+    @router.route('api/data-refresh', key=lambda *_: 'api')
+    async def data_refresh(*_):
+        manager.refresh()
+
+    @router.route('api/subscribe_devices', key=lambda *_: 'api')
+    async def subscribe_devices(_, payload):
+        await manager.subscribe_devices(payload)
+
+    @router.route('api/device/+', key=data_key('devices'))
+    async def device_method(segments, payload):
+        await manager.device_method(segments[2], payload)
+
+    @router.route('api/tag/+', key=data_key('tags'))
+    async def tag_method(segments, payload):
+        await manager.tag_method(segments[2], payload)
+
+    @router.route('api/location/+', key=data_key('locations'))
+    async def location_method(segments, payload):
+        await manager.location_method(segments[2], payload)
+
+    @router.route('calendar/+/+/+', key=lambda segments, payload: (f'{segments[2]}s', payload['data']['id']))
+    async def calendar(segments, payload):
+        _, edge, type, method_name = segments
+        logger.debug('Calendar event: %s %s %s %s',
+                     edge, type, method_name, payload)
+        if method_name != 'clear':
+            await getattr(manager, f'{type}_method')(method_name, payload)
+        await getattr(manager, f'{type}s')[payload['data']['id']].calendar_edge(edge, method_name)
+
+    @router.route('knx/switch/+', key=lambda segments, _: ('locations', int(segments[2])))
+    async def knx_switch(segments, payload):
+        location_id = int(segments[2])
+        await manager.location_method('knx_switch', {'data': {'id': location_id}, 'params': payload})
+
+    @router.route('fac/+/+', key=lambda segments, _: ('locations', segments[2]))
+    async def fac(segments, _):
+        method_name = segments[1]
+        for location_id in segments[2].split(','):
+            location_id = int(location_id)
+            await manager.location_method(method_name, {'data': {'id': location_id}})
+
+    return router
+
+
 @click.command()
 @click.option('--ca_certificate', default='/opt/tls/ca_certificate.pem')
 @click.option('--client_certificate', default='/opt/tls/client_certificate.pem')
@@ -40,73 +117,18 @@ async def main(ca_certificate, client_certificate, client_key):
         manager = Manager(client)
         await manager.setup(initial=True)
         manager_task = loop.create_task(manager.start())
+        dispatcher = Dispatcher()
+        dispatcher.start()
+        dispatcher_task = loop.create_task(
+            dispatcher.report(client, sources={'ping': ping_cache.stats}))
+        router = make_router(manager, client, dispatcher)
         async with client.messages() as messages:
             async for message in messages:
                 # logger.debug(message.topic.value)
                 await manager.on_message(message.topic, message.payload)
-                if message.topic.matches('probe/#'):
-                    _, fqdn, device_method = message.topic.value.split('/')
-                    try:
-                        device_id = [id for id, dev
-                                     in manager.devices.items()
-                                     if dev.name == fqdn][0]
-                        method = getattr(
-                            manager.devices[device_id], f'on_{device_method}')
-                        await method(message.payload.decode())
-                    except IndexError as e:
-                        message = f'Device not subscribed: {fqdn}'
-                        json_payload = json.dumps({
-                            'error': {
-                                'message': message,
-                                'time': time.time() * 1000
-                            }
-                        })
-                        await client.publish('manager/device_event', json_payload)
-                        logger.error(message)
-                    continue
-                try:
-                    payload = json.loads(message.payload)
-                except:
-                    payload = {}
-                if message.topic.matches('api/data-refresh'):
-                    await manager.setup()
-                try:
-                    if message.topic.matches('api/subscribe_devices'):
-                        await manager.subscribe_devices(payload)
-                        continue
-                    if message.topic.matches('api/device/+'):
-                        method_name = message.topic.value.split('/')[2]
-                        await manager.device_method(method_name, payload)
-                        continue
-                    if message.topic.matches('api/tag/+'):
-                        method_name = message.topic.value.split('/')[2]
-                        await manager.tag_method(method_name, payload)
-                        continue
-                    if message.topic.matches('api/location/+'):
-                        method_name = message.topic.value.split('/')[2]
-                        await manager.location_method(method_name, payload)
-                        continue
-                    if message.topic.matches('calendar/#'):
-                        edge = message.topic.value.split('/')[1]
-                        type = message.topic.value.split('/')[2]
-                        method_name = message.topic.value.split('/')[3]
-                        logger.debug('Calendar event: %s %s %s %s',
-                                     edge, type, method_name, payload)
-                        if method_name != 'clear':
-                            await getattr(manager, f'{type}_method')(method_name, payload)
-                        await getattr(manager, f'{type}s')[payload['data']['id']].calendar_edge(edge, method_name)
-                        continue
-                    if message.topic.matches('knx/switch/#'):
-                        location_id = int(message.topic.value.split('/')[2])
-                        await manager.location_method('knx_switch', {'data': {'id': location_id}, 'params': payload})
-                    if message.topic.matches('fac/#'):
-                        method_name = message.topic.value.split('/')[1]
-                        location_ids = message.topic.value.split('/')[2]
-                        for location_id in location_ids.split(','):
-                            location_id = int(location_id)
-                            await manager.location_method(method_name, {'data': {'id': location_id}})
-                except Exception as e:
-                    logger.exception(e)
+                await router.dispatch(message.topic.value, message.payload)
+        dispatcher.cancel()
+        dispatcher_task.cancel()
         await manager_task
 
 
@@ -1,14 +1,167 @@
-import requests
-from requests.auth import HTTPDigestAuth
+import os
+import re
+import hashlib
+import secrets
+from typing import Any
 
+import aiohttp
+
+from misc import logger, memoize
+
+from .device import DeviceState
 from .icmpable import ICMPable
 
+BRIGHTSIGN_USER = os.environ.get('BRIGHTSIGN_USER', 'admin')
+BRIGHTSIGN_PASSWORD = os.environ.get('BRIGHTSIGN_PASSWORD', 'avm')
+
+DIGEST_ALGORITHMS = {
+    'MD5': hashlib.md5,
+    'MD5-SESS': hashlib.md5,
+    'SHA-256': hashlib.sha256,
+    'SHA-256-SESS': hashlib.sha256
+}
+
+
+def parse_challenge(header: str) -> dict[str, str]:
+    _, _, params = header.partition(' ')
+    return {key.lower(): quoted or plain
+            for key, quoted, plain in re.findall(r'(\w+)=(?:"([^"]*)"|([^,\s]*))', params)}
+
+
+class DigestAuth:
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.challenges: dict[str, dict[str, Any]] = {}
+
+    def challenge(self, host: str, header: str) -> bool:
+        if not header.lower().startswith('digest'):
+            return False
+        challenge = parse_challenge(header)
+        if 'nonce' not in challenge:
+            return False
+        previous = self.challenges.get(host)
+        is_stale = challenge.get('stale', '').lower() == 'true'
+        if previous is not None and previous['nonce'] == challenge['nonce'] and not is_stale:
+            return False
+        challenge['nc'] = 0
+        self.challenges[host] = challenge
+        return True
+
+    def header(self, host: str, method: str, uri: str) -> str | None:
+        challenge = self.challenges.get(host)
+        if challenge is None:
+            return None
+        algorithm = challenge.get('algorithm', 'MD5').upper()
+        hash = DIGEST_ALGORITHMS.get(algorithm, hashlib.md5)
+
+        def h(value: str) -> str:
+            return hash(value.encode()).hexdigest()
+
+        challenge['nc'] += 1
+        nc = f'{challenge["nc"]:08x}'
+        cnonce = secrets.token_hex(8)
+        ha1 = h(f'{self.username}:{challenge.get("realm", "")}:{self.password}')
+        if algorithm.endswith('-SESS'):
+            ha1 = h(f'{ha1}:{challenge["nonce"]}:{cnonce}')
+        ha2 = h(f'{method}:{uri}')
+        qop = 'auth' if 'auth' in [token.strip() for token in challenge.get('qop', '').split(',')] else None
+        if qop:
+            response = h(f'{ha1}:{challenge["nonce"]}:{nc}:{cnonce}:{qop}:{ha2}')
+        else:
+            response = h(f'{ha1}:{challenge["nonce"]}:{ha2}')
+        params = [
+            f'username="{self.username}"',
+            f'realm="{challenge.get("realm", "")}"',
+            f'nonce="{challenge["nonce"]}"',
+            f'uri="{uri}"',
+            f'response="{response}"',
+            f'algorithm={algorithm}'
+        ]
+        if 'opaque' in challenge:
+            params.append(f'opaque="{challenge["opaque"]}"')
+        if qop:
+            params += [f'qop={qop}', f'nc={nc}', f'cnonce="{cnonce}"']
+        return 'Digest ' + ', '.join(params)
+
+
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=2),
+            timeout=aiohttp.ClientTimeout(total=10))
+    return _session
+
+
+digest_auth = DigestAuth(BRIGHTSIGN_USER, BRIGHTSIGN_PASSWORD)
+
+
+class BrightSignClient:
+    def __init__(self, host: str, auth: DigestAuth = digest_auth, base_url: str | None = None):
+        self.host = host
+        self.auth = auth
+        self.base_url = base_url or f'http://{host}'
+
+    async def request(self, method: str, path: str) -> Any:
+        session = get_session()
+        for _ in range(2):
+            headers = {}
+            authorization = self.auth.header(self.host, method, path)
+            if authorization is not None:
+                headers['Authorization'] = authorization
+            async with session.request(method, self.base_url + path, headers=headers) as response:
+                if response.status == 401:
+                    if self.auth.challenge(self.host, response.headers.get('WWW-Authenticate', '')):
+                        continue
+                    break
+                response.raise_for_status()
+                if response.content_type == 'application/json':
+                    data = await response.json()
+                    if isinstance(data, dict):
+                        return data.get('data', {}).get('result', data)
+                    return data
+                return await response.text()
+        raise PermissionError(f'{method} {path} unauthorized')
+
 
 class BrightSign(ICMPable):
     _capabilities = ['reboot']
 
+    def __init__(self, *args, status_interval: float = 300, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.intervals['status'] = status_interval
+        self._state['firmware'] = ''
+        self._state['uptime'] = 0
+        self._state['health'] = ''
+        self.ip = self.primary_ip['address'].split('/')[0]
+        self.http = BrightSignClient(self.ip)
+        self.update_methods.append(('BrightSign status', self._watch_status))
+
+    async def _set_status(self, key: str, value):
+        if value is not None and self._state[key] != value:
+            self._state[key] = value
+            await self.event(key, value)
+
+    @memoize('status')
+    async def _watch_status(self):
+        if self.is_online != DeviceState.ON:
+            return
+        info = await self.http.request('GET', '/api/v1/info')
+        await self._set_status('firmware', info.get('FWVersion'))
+        await self._set_status('uptime', info.get('upTimeSeconds', info.get('upTime')))
+        health = await self.http.request('GET', '/api/v1/health')
+        await self._set_status('health', health.get('status') if isinstance(health, dict) else health)
+        logger.debug('%s %s', self.name, {key: self._state[key] for key in ['firmware', 'uptime', 'health']})
+
     async def reboot(self, *_, **__):
-        ip = self.primary_ip['address'].split('/')[0]
-        requests.put(
-            f'http://{ip}/api/v1/control/reboot',
-            auth=HTTPDigestAuth('admin', 'avm'))
+        await self.http.request('PUT', '/api/v1/control/reboot')
+
+    async def fetch(self):
+        await super().fetch()
+        await self.event('firmware', self._state['firmware'])
+        await self.event('uptime', self._state['uptime'])
+        await self.event('health', self._state['health'])
@@ -94,7 +94,7 @@ class Computer(WOLable):
         try:
             payload = json.loads(args)
             if 'data' in payload:
-                self._state['fans'] = json.loads(args)['data']['result']
+                self._state['fans'] = payload['data']['result']
                 await self.event('fans', self._state['fans'])
             elif 'error' in payload:
                 raise Exception(payload['error']['message'],
@@ -3,6 +3,7 @@ from typing import Any, Callable
 
 from aiomqtt import Client
 from devices.mixins import ErrorMixin, EventMixin, PowerMixin, CalendarMixin
+from misc import CallState
 
 from locations import Location
 from .state import DeviceState
@@ -29,6 +30,8 @@ class Device(EventMixin, ErrorMixin, PowerMixin, CalendarMixin):
         self.intervals: dict[str, float] = {}
         self.timeouts: dict[str, float] = {}
         self.start_times: dict[str, float] = {}
+        self.call_states: dict[str, CallState] = {}
+        self._waiters: list[tuple[tuple, asyncio.Future]] = []
         self.update_methods: list[tuple[str, Callable]] = []
         self.tasks: dict[str, asyncio.Task] = dict()
         self.power_task = None
@@ -56,6 +59,7 @@ class Device(EventMixin, ErrorMixin, PowerMixin, CalendarMixin):
         for key in self._state:
             if key.startswith('should'):
                 await getattr(self, f'set_{key}')(False)
+                self.call_states.pop('timeout_' + key.removeprefix('should_'), None)
         [task.cancel() for task in self.tasks.values()]
         try:
             self.lock.release()
@@ -68,8 +72,21 @@ class Device(EventMixin, ErrorMixin, PowerMixin, CalendarMixin):
         return method
 
     async def wait_for(self, *states):
-        while self._state['is_online'] not in states:
-            await asyncio.sleep(1)
+        if self._state['is_online'] in states:
+            return
+        waiter = (states, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        finally:
+            self._waiters.remove(waiter)
+
+    @property
+    def address(self) -> str | None:
+        ip = self.__dict__.get('primary_ip')
+        if ip is None:
+            return None
+        return ip['address'].split('/')[0]
 
     @property
     def is_initialized(self):
@@ -100,9 +117,27 @@ class Device(EventMixin, ErrorMixin, PowerMixin, CalendarMixin):
         else:
             self._offline_counter = 0
             if self._state['is_online'] != value:
-                self._state['is_online'] = value
+                self._transition(value)
                 await self.event('is_online', value)
 
+    def _transition(self, value):
+        previous = self._state['is_online']
+        self._state['is_online'] = value
+        self.manager.topology.transition(self, previous, value)
+        for states, future in self._waiters:
+            if value in states and not future.done():
+                future.set_result(value)
+
+    def snapshot_state(self) -> dict[str, Any]:
+        return {'is_online': self._state['is_online']}
+
+    def restore_state(self, state: dict[str, Any]):
+        for key, value in state.items():
+            if key == 'is_online':
+                self._transition(value)
+            elif key in self._state:
+                self._state[key] = value
+
     def is_tagged(self, tag):
         return tag.name in [tag['name'] for tag in self.tags]
 
@@ -124,14 +159,12 @@ class Device(EventMixin, ErrorMixin, PowerMixin, CalendarMixin):
                 del self.tasks[task_name]
         return wrap
 
-    async def update(self):
-        for name, method in self.update_methods:
-            task_name = self.name + name
-            if task_name not in self.tasks:
-                task: asyncio.Task = asyncio.create_task(
-                    self._try_method(method, error_cb=self._delete_task(task_name)))
-                self.tasks[task_name] = task
-                task.add_done_callback(self._delete_task(task_name))
+    def run_update(self, name: str, method: Callable, **kwargs) -> asyncio.Task:
+        task_name = self.name + name
+        task: asyncio.Task = asyncio.create_task(self._try_method(method, **kwargs))
+        self.tasks[task_name] = task
+        task.add_done_callback(self._delete_task(task_name))
+        return task
 
     async def fetch(self, *_, **__):
         await self.event('class', self.__class__.__name__)
@@ -0,0 +1,199 @@
+import asyncio
+import ipaddress
+import random
+import socket
+import struct
+import time
+from collections import deque
+
+from icmplib import async_ping
+
+from misc import logger
+
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+
+def checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def echo_request(identifier: int, sequence: int, payload: bytes) -> bytes:
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0,
+                         checksum(header + payload), identifier, sequence)
+    return header + payload
+
+
+class PingEngine:
+    def __init__(self, timeout: float = 10, payload_size: int = 56):
+        self.timeout = timeout
+        self.identifier = random.getrandbits(16)
+        self.payload = bytes(payload_size)
+        self._sequence = 0
+        self._pending: dict[tuple[str, int], asyncio.Future] = {}
+        self._outbox: deque[tuple[tuple[str, int], bytes]] = deque()
+        self._socket: socket.socket | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._is_flush_scheduled = False
+        self._is_available = True
+        self.sent = 0
+        self.received = 0
+
+    def _open(self):
+        self._loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+        self._socket = sock
+
+    def close(self):
+        if self._socket is not None:
+            if self._loop is not None:
+                self._loop.remove_reader(self._socket.fileno())
+                self._loop.remove_writer(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        self._outbox.clear()
+
+    def _next_sequence(self) -> int:
+        self._sequence = (self._sequence + 1) & 0xffff
+        return self._sequence
+
+    def _schedule_flush(self):
+        if not self._is_flush_scheduled:
+            self._is_flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._is_flush_scheduled = False
+        self._loop.remove_writer(self._socket.fileno())
+        while self._outbox:
+            key, packet = self._outbox[0]
+            if key not in self._pending:
+                self._outbox.popleft()
+                continue
+            address = key[0]
+            try:
+                self._socket.sendto(packet, (address, 0))
+            except BlockingIOError:
+                self._loop.add_writer(self._socket.fileno(), self._flush)
+                return
+            except OSError as e:
+                logger.debug('ICMP send to %s failed: %s', address, e)
+            self._outbox.popleft()
+            self.sent += 1
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, (address, _) = self._socket.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug('ICMP receive failed: %s', e)
+                return
+            offset = (data[0] & 0x0f) * 4
+            if len(data) < offset + 8:
+                continue
+            icmp_type, _, _, identifier, sequence = struct.unpack_from(
+                '!BBHHH', data, offset)
+            if icmp_type != ICMP_ECHO_REPLY or identifier != self.identifier:
+                continue
+            future = self._pending.pop((address, sequence), None)
+            if future is not None and not future.done():
+                self.received += 1
+                future.set_result(True)
+
+    def _is_ipv4(self, address: str) -> bool:
+        try:
+            return ipaddress.ip_address(address).version == 4
+        except ValueError:
+            return False
+
+    async def ping(self, address: str, timeout: float | None = None) -> bool:
+        if timeout is None:
+            timeout = self.timeout
+        if self._socket is None and self._is_available:
+            try:
+                self._open()
+            except OSError as e:
+                self._is_available = False
+                logger.error('Raw ICMP socket unavailable, falling back to icmplib: %s', e)
+        if self._socket is None or not self._is_ipv4(address):
+            host = await async_ping(address, count=1, timeout=timeout, privileged=True)
+            return host.is_alive
+
+        sequence = self._next_sequence()
+        key = (address, sequence)
+        future = self._loop.create_future()
+        self._pending[key] = future
+        self._outbox.append(
+            (key, echo_request(self.identifier, sequence, self.payload)))
+        self._schedule_flush()
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        except TimeoutError:
+            return False
+        finally:
+            self._pending.pop(key, None)
+
+    async def ping_many(self, addresses: list[str], timeout: float | None = None) -> dict[str, bool]:
+        results = await asyncio.gather(
+            *[self.ping(address, timeout) for address in addresses])
+        return dict(zip(addresses, results))
+
+
+class PingCache:
+    def __init__(self, engine: PingEngine, ttl: float = 2):
+        self.engine = engine
+        self.ttl = ttl
+        self._results: dict[str, tuple[float, bool]] = {}
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _store(self, address: str):
+        def wrap(task: asyncio.Future):
+            self._in_flight.pop(address, None)
+            if not task.cancelled() and task.exception() is None:
+                self._results[address] = (time.monotonic(), task.result())
+        return wrap
+
+    async def ping(self, address: str, timeout: float | None = None) -> bool:
+        cached = self._results.get(address)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.hits += 1
+            return cached[1]
+        task = self._in_flight.get(address)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self.engine.ping(address, timeout))
+            self._in_flight[address] = task
+            task.add_done_callback(self._store(address))
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'misses': self.misses
+        }
+
+
+ping_engine = PingEngine()
+ping_cache = PingCache(ping_engine)
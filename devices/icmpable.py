@@ -1,16 +1,11 @@
-from icmplib import async_ping
-
 from misc import memoize
 
 from .device import Device, DeviceState
+from .icmp import ping_cache
 
 
 async def ping_address(address: str) -> bool:
-    host = await async_ping(address,
-                            count=1,
-                            timeout=10,
-                            privileged=True)
-    return host.is_alive
+    return await ping_cache.ping(address, timeout=10)
 
 
 class ICMPable(Device):
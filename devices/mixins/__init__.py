@@ -2,3 +2,4 @@ from .error_mixin import ErrorMixin        # pyright: ignore
 from .event_mixin import EventMixin        # pyright: ignore
 from .power_mixin import PowerMixin        # pyright: ignore
 from .calendar_mixin import CalendarMixin  # pyright: ignore
+from .push_mixin import PushMixin          # pyright: ignore
@@ -17,21 +17,23 @@ class PowerMixin:
         self.client = client
         self.power_task = None
 
-    async def set_power(self, state: bool):
+    async def set_power(self, state: bool, wait=False):
         power_ports = getattr(self, 'power_ports', [])
         has_switched = False
+        futures = []
         for power_port in power_ports:
             for power_feed in power_port['link_peers']:
                 try:
                     power_panel = power_feed['power_panel']
                     powerfeed_id = int(power_feed['name'])
-                    pdu = [device
-                           for device in self.manager.devices.values()
-                           if device.name == power_panel['name']][0]
-                    has_switched = await pdu.write_powerfeed(powerfeed_id, state)
+                    pdu = self.manager.devices_by_name[power_panel['name']]
+                    has_switched = has_switched or pdu.powerfeeds[powerfeed_id] != state
+                    futures.append(await pdu.write_powerfeed(powerfeed_id, state))
                 except Exception as e:
                     logger.exception(self.name)
                     await self._handle_exception(e)
+        if wait and futures:
+            await asyncio.gather(*futures)
         return has_switched
 
     async def async_power_off(self, wait):
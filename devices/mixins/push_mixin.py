@@ -0,0 +1,29 @@
+import time
+import asyncio
+from typing import Callable
+
+
+class PushMixin:
+    def init_push(self, interval_key: str, reconcile_interval: float, push_timeout: float):
+        self.push_interval_key = interval_key
+        self.poll_interval = self.intervals[interval_key]
+        self.reconcile_interval = reconcile_interval
+        self.push_timeout = push_timeout
+        self.last_push = float('-inf')
+        self.push_tasks: set[asyncio.Task] = set()
+
+    @property
+    def is_pushing(self) -> bool:
+        return time.monotonic() - self.last_push < self.push_timeout
+
+    def push(self, method: Callable, **kwargs) -> asyncio.Task:
+        self.last_push = time.monotonic()
+        self.intervals[self.push_interval_key] = max(self.poll_interval, self.reconcile_interval)
+        task = asyncio.create_task(self._try_method(method, **kwargs))
+        self.push_tasks.add(task)
+        task.add_done_callback(self.push_tasks.discard)
+        return task
+
+    def check_push(self):
+        if not self.is_pushing:
+            self.intervals[self.push_interval_key] = self.poll_interval
@@ -1,11 +1,16 @@
 import asyncio
+import copy
 import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
 
-from aiopjlink import PJLink as PJLinkInterface, Power
+from aiopjlink import Errors, PJLink as PJLinkInterface, PJLinkConnectionClosed, PJLinkNoConnection, Power
 
 from misc import logger, memoize
 
 from .device import Device, DeviceState
+from .mixins import PushMixin
 from .icmpable import ping_address
 
 
@@ -18,12 +23,103 @@ initial_state = {
 }
 
 
-class PJLink(Device):
+class PJLinkSession:
+    def __init__(self, address: str, password: str, timeout: float = 10, idle_timeout: float = 20,
+                 port: int = 4352):
+        self.address = address
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.interface: PJLinkInterface | None = None
+        self.lock = asyncio.Lock()
+        self.last_used = float('-inf')
+        self.round_trip_times: deque[float] = deque()
+        self.connects = 0
+
+    @property
+    def round_trips_per_minute(self) -> int:
+        now = time.monotonic()
+        while self.round_trip_times and now - self.round_trip_times[0] > 60:
+            self.round_trip_times.popleft()
+        return len(self.round_trip_times)
+
+    async def _connect(self):
+        interface = PJLinkInterface(
+            address=self.address, port=self.port, password=self.password, timeout=self.timeout)
+        await interface.__aenter__()
+        self.interface = interface
+        self.connects += 1
+        self.round_trip_times.append(time.monotonic())
+
+    async def close(self):
+        interface, self.interface = self.interface, None
+        if interface is not None:
+            try:
+                await interface.__aexit__(None, None, None)
+            except Exception:
+                pass
+
+    async def run(self, command: Callable[[PJLinkInterface], Awaitable[Any]]) -> Any:
+        async with self.lock:
+            if self.interface is not None and time.monotonic() - self.last_used > self.idle_timeout:
+                await self.close()
+            is_reused = self.interface is not None
+            while True:
+                if self.interface is None:
+                    await self._connect()
+                try:
+                    result = await command(self.interface)
+                except (OSError, EOFError, TimeoutError, PJLinkNoConnection, PJLinkConnectionClosed):
+                    await self.close()
+                    if not is_reused:
+                        raise
+                    is_reused = False
+                    continue
+                except asyncio.CancelledError:
+                    await self.close()
+                    raise
+                finally:
+                    self.last_used = time.monotonic()
+                self.round_trip_times.append(self.last_used)
+                return result
+
+
+class PJLinkNotificationProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback: Callable[[str, tuple[str, int]], Any]):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        for message in data.decode('ascii', 'replace').split('\r'):
+            message = message.strip()
+            if message.startswith('%') and len(message) > 7 and message[6] == '=':
+                try:
+                    self.callback(message, addr)
+                except Exception as e:
+                    logger.exception(e)
+
+
+async def listen_notifications(callback: Callable[[str, tuple[str, int]], Any],
+                               port: int = 4352,
+                               host: str = '0.0.0.0') -> asyncio.DatagramTransport:
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: PJLinkNotificationProtocol(callback), local_addr=(host, port))
+    return transport
+
+
+class PJLink(PushMixin, Device):
     _capabilities = ['wake', 'shutdown']
 
     def __init__(self,
                  *args,
                  watch_interval: float = 10,
+                 status_interval: float = 60,
+                 info_interval: float = 600,
+                 report_interval: float = 60,
+                 idle_timeout: float = 20,
+                 reconcile_interval: float = 300,
+                 notification_timeout: float = 3600,
                  wake_interval: float = 30,
                  shutdown_interval: float = 30,
                  max_time_to_wake: float = 900,
@@ -36,6 +132,10 @@ class PJLink(Device):
         self._reset_state()
 
         self.intervals['watch'] = watch_interval
+        self.intervals['status'] = status_interval
+        self.intervals['info'] = info_interval
+        self.intervals['report'] = report_interval
+        self.init_push('watch', reconcile_interval, notification_timeout)
         self.intervals['wake'] = wake_interval
         self.intervals['shutdown'] = shutdown_interval
         self.timeouts['wake'] = max_time_to_wake
@@ -47,19 +147,17 @@ class PJLink(Device):
         ip = getattr(self, 'primary_ip')
         address = ip['address'].split('/')[0]
         self.ip = address
-        self.is_open = False
+        self.session = PJLinkSession(
+            self.ip, os.environ['PJLINK_PASSWORD'], connection_timeout, idle_timeout)
 
         self.update_methods.append(('PJLink watch', self._watch))
-
-    async def _get_interface(self):
-        return PJLinkInterface(
-            address=self.ip,
-            password=os.environ['PJLINK_PASSWORD'],
-            timeout=self.connection_timeout)
+        self.update_methods.append(('PJLink errors', self._watch_errors))
+        self.update_methods.append(('PJLink info', self._watch_info))
+        self.update_methods.append(('PJLink report', self._report))
 
     def _reset_state(self):
         for key, value in initial_state.items():
-            self._state[key] = value
+            self._state[key] = copy.deepcopy(value)
 
     async def online_event(self, _, event_type, value):
         if event_type == 'is_online':
@@ -67,22 +165,9 @@ class PJLink(Device):
             await self.set_should_shutdown(self.should_shutdown and value not in [DeviceState.OFF, DeviceState.PARTIAL])
             if value != DeviceState.ON:
                 self._reset_state()
-
-    async def _open(self):
-        if self._interface is None:
-            self._interface = await self._get_interface()
-        if not self.is_open:
-            try:
-                await self._interface.__aenter__()
-            except:
-                self._interface = await self._get_interface()
-                raise
-            self.is_open = True
-        return self._interface
-
-    async def _close(self):
-        await self._interface.__aexit__(None, None, None)
-        self.is_open = False
+            else:
+                self.manager.scheduler.run_now(self, self._watch_errors)
+                self.manager.scheduler.run_now(self, self._watch_info)
 
     async def _set_power_state(self, power_state: Power.State):
         match power_state:
@@ -107,23 +192,48 @@ class PJLink(Device):
                 self._state['warming'] = False
                 self._state['cooling'] = False
 
+    def on_notification(self, message: str):
+        self.push(self._apply_notification, message=message)
+
+    async def _apply_notification(self, message: str):
+        command, value = message[2:6], message[7:]
+        logger.debug('%s notification %s', self.name, message)
+        match command:
+            case 'POWR':
+                try:
+                    power_state = Power.State(value)
+                except ValueError:
+                    return
+                await self._set_power_state(power_state)
+            case 'ERST' if len(value) == len(Errors.Category):
+                try:
+                    errors = {category: Errors.Level(level)
+                              for category, level in zip(Errors.Category, value)}
+                except ValueError:
+                    return
+                await self._update_errors(errors)
+
     @memoize('watch')
     async def _watch(self):
+        self.check_push()
         if await ping_address(self.ip):
-            await self._open()
-            power_state = await self._interface.power.get()
+            power_state = await self.session.run(lambda interface: interface.power.get())
             await self._set_power_state(power_state)
-            await self._watch_status(self._interface)
-            await self._close()
         else:
+            await self.session.close()
             await self.set_is_online(DeviceState.OFF)
 
+    @memoize('report')
+    async def _report(self):
+        await self.event('round_trips_per_minute', self.session.round_trips_per_minute)
+
     async def _update_errors(self, errors):
+        await self._set_errors({key.value: value.name.lower() for key, value in errors.items()})
+
+    async def _set_errors(self, errors: dict[str, str]):
         has_error_event = False
-        for key, value in errors.items():
-            error_name = key.value
-            error_value = value.name.lower()
-            if error_name not in self._state['errors'] or self._state['errors'][key.value] != error_value:
+        for error_name, error_value in errors.items():
+            if error_name not in self._state['errors'] or self._state['errors'][error_name] != error_value:
                 has_error_event = True
                 self._state['errors'][error_name] = error_value
         if has_error_event:
@@ -143,16 +253,16 @@ class PJLink(Device):
         if has_lamps_event:
             await self.event('lamps', self._state['lamps'])
             
-    async def _update_class(self, interface):
+    async def _update_class(self):
         try:
-            interface_class = await interface.info.pjlink_class()
-            self._state['class'] = interface_class.value
+            interface_class = await self.session.run(lambda interface: interface.info.pjlink_class())
+            self._state['class'] = int(interface_class.value)
         except:
             self._state['class'] = 1
 
-    async def _update_ires(self, interface):
+    async def _update_ires(self):
         try:
-            x, y = await interface.sources.resolution()
+            x, y = await self.session.run(lambda interface: interface.sources.resolution())
             ires = f'{x}x{y}'
             if ires != self._state['ires']:
                 self._state['ires'] = ires
@@ -160,38 +270,43 @@ class PJLink(Device):
         except:
             pass
 
-    async def _watch_status(self, interface):
-        if 'class' not in self._state:
-            await self._update_class(interface)
+    @memoize('status')
+    async def _watch_errors(self):
+        if self.is_online == DeviceState.OFF:
+            return
         try:
-            errors = await interface.errors.query()
+            errors = await self.session.run(lambda interface: interface.errors.query())
         except:
             errors = self._state['errors']
+
         try:
-            lamps = await interface.lamps.status()
-        except:
-            lamps = []
-    
-        try:
-            await self._update_lamps(lamps)
+            await self._update_errors(errors)
         except Exception as e:
             await self._handle_exception(e)
 
+    @memoize('info')
+    async def _watch_info(self):
+        if self.is_online == DeviceState.OFF:
+            return
+        if 'class' not in self._state:
+            await self._update_class()
+        try:
+            lamps = await self.session.run(lambda interface: interface.lamps.status())
+        except:
+            lamps = []
+
         try:
-            await self._update_errors(errors)
+            await self._update_lamps(lamps)
         except Exception as e:
             await self._handle_exception(e)
 
         if self._state['class'] == 2:
-            await self._update_ires(interface)
+            await self._update_ires()
 
     async def _wake(self):
         async def inner():
-            await self._open()
-            logger.debug(
-                'Authentication succeeded, set_power on')
-            await self._interface.power.turn_on()
-            await self._close()
+            await self.session.run(lambda interface: interface.power.turn_on())
+            logger.debug('%s set_power on', self.name)
         async with asyncio.timeout(self.timeouts['wake']):
             while self.should_wake:
                 if self.is_online in [DeviceState.OFF, DeviceState.PARTIAL]:
@@ -202,11 +317,8 @@ class PJLink(Device):
 
     async def _shutdown(self):
         async def inner():
-            await self._open()
-            logger.debug(
-                'Authentication succeeded, set_power off')
-            await self._interface.power.turn_off()
-            await self._close()
+            await self.session.run(lambda interface: interface.power.turn_off())
+            logger.debug('%s set_power off', self.name)
         async with asyncio.timeout(self.timeouts['shutdown']):
             while self.should_shutdown:
                 if self.is_online == DeviceState.ON:
@@ -0,0 +1,342 @@
+import asyncio
+import random
+from typing import Any, Callable, NamedTuple, Sequence
+
+from misc import logger
+
+
+SNMP_VERSION_1 = 0
+SNMP_VERSION_2C = 1
+
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+GET_REQUEST = 0xa0
+GET_NEXT_REQUEST = 0xa1
+GET_RESPONSE = 0xa2
+SET_REQUEST = 0xa3
+TRAP_V1 = 0xa4
+GET_BULK_REQUEST = 0xa5
+INFORM_REQUEST = 0xa6
+TRAP_V2 = 0xa7
+
+
+class SnmpVarbind(NamedTuple):
+    oid: str
+    value: Any
+
+
+class SnmpError(Exception):
+    pass
+
+
+class SnmpPDU(NamedTuple):
+    version: int
+    community: bytes
+    type: int
+    request_id: int
+    error_status: int
+    error_index: int
+    varbinds: list[SnmpVarbind]
+
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def encode_tlv(tag: int, payload: bytes) -> bytes:
+    return bytes([tag]) + encode_length(len(payload)) + payload
+
+
+def encode_integer(value: int, tag: int = INTEGER) -> bytes:
+    length = max(1, (value.bit_length() + 8) // 8)
+    return encode_tlv(tag, value.to_bytes(length, 'big', signed=True))
+
+
+def encode_oid(oid: str) -> bytes:
+    parts = [int(part) for part in oid.strip('.').split('.')]
+    payload = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7f]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7f))
+            part >>= 7
+        payload.extend(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(payload))
+
+
+def encode_value(value: Any) -> bytes:
+    if value is None:
+        return encode_tlv(NULL, b'')
+    if isinstance(value, bool):
+        return encode_integer(int(value))
+    if isinstance(value, int):
+        return encode_integer(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return encode_tlv(OCTET_STRING, bytes(value))
+
+
+def encode_message(community: str,
+                   pdu_type: int,
+                   request_id: int,
+                   varbinds: Sequence[tuple[str, Any]],
+                   error_status: int = 0,
+                   error_index: int = 0) -> bytes:
+    encoded_varbinds = b''.join(
+        encode_tlv(SEQUENCE, encode_oid(oid) + encode_value(value))
+        for oid, value in varbinds)
+    pdu = encode_tlv(pdu_type,
+                     encode_integer(request_id)
+                     + encode_integer(error_status)
+                     + encode_integer(error_index)
+                     + encode_tlv(SEQUENCE, encoded_varbinds))
+    return encode_tlv(SEQUENCE,
+                      encode_integer(SNMP_VERSION_2C)
+                      + encode_value(community)
+                      + pdu)
+
+
+def decode_tlv(data: bytes, offset: int) -> tuple[int, bytes, int]:
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        num_bytes = length & 0x7f
+        length = int.from_bytes(data[offset:offset + num_bytes], 'big')
+        offset += num_bytes
+    end = offset + length
+    if end > len(data):
+        raise SnmpError('Truncated SNMP message')
+    return tag, data[offset:end], end
+
+
+def decode_oid(payload: bytes) -> str:
+    parts = [payload[0] // 40, payload[0] % 40]
+    value = 0
+    for byte in payload[1:]:
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            parts.append(value)
+            value = 0
+    return '.'.join(str(part) for part in parts)
+
+
+def decode_value(tag: int, payload: bytes) -> Any:
+    match tag:
+        case 0x02:
+            return int.from_bytes(payload, 'big', signed=True)
+        case 0x41 | 0x42 | 0x43 | 0x46:
+            return int.from_bytes(payload, 'big')
+        case 0x04:
+            return payload
+        case 0x06:
+            return decode_oid(payload)
+        case 0x40:
+            return '.'.join(str(byte) for byte in payload)
+        case _:
+            return None
+
+
+def decode_varbinds(payload: bytes) -> list[SnmpVarbind]:
+    varbinds = []
+    offset = 0
+    while offset < len(payload):
+        _, varbind, offset = decode_tlv(payload, offset)
+        _, oid, value_offset = decode_tlv(varbind, 0)
+        tag, value, _ = decode_tlv(varbind, value_offset)
+        varbinds.append(SnmpVarbind(decode_oid(oid), decode_value(tag, value)))
+    return varbinds
+
+
+def decode_message(data: bytes) -> SnmpPDU:
+    _, message, _ = decode_tlv(data, 0)
+    _, version, offset = decode_tlv(message, 0)
+    _, community, offset = decode_tlv(message, offset)
+    pdu_type, pdu, _ = decode_tlv(message, offset)
+    version = decode_value(INTEGER, version)
+    if pdu_type == TRAP_V1:
+        _, enterprise, offset = decode_tlv(pdu, 0)
+        _, _, offset = decode_tlv(pdu, offset)
+        _, generic_trap, offset = decode_tlv(pdu, offset)
+        _, specific_trap, offset = decode_tlv(pdu, offset)
+        _, _, offset = decode_tlv(pdu, offset)
+        _, varbinds, _ = decode_tlv(pdu, offset)
+        return SnmpPDU(version, community, pdu_type, 0,
+                       decode_value(INTEGER, generic_trap),
+                       decode_value(INTEGER, specific_trap),
+                       [SnmpVarbind('enterprise', decode_oid(enterprise)),
+                        *decode_varbinds(varbinds)])
+    _, request_id, offset = decode_tlv(pdu, 0)
+    _, error_status, offset = decode_tlv(pdu, offset)
+    _, error_index, offset = decode_tlv(pdu, offset)
+    _, varbinds, _ = decode_tlv(pdu, offset)
+    return SnmpPDU(version, community, pdu_type,
+                   decode_value(INTEGER, request_id),
+                   decode_value(INTEGER, error_status),
+                   decode_value(INTEGER, error_index),
+                   decode_varbinds(varbinds))
+
+
+class SnmpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        self.engine.on_response(data, addr)
+
+    def error_received(self, exc):
+        logger.debug('SNMP socket error: %s', exc)
+
+
+class SnmpTrapProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback: Callable[[SnmpPDU, tuple[str, int]], Any]):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        try:
+            pdu = decode_message(data)
+        except Exception as e:
+            logger.debug('Invalid SNMP trap from %s: %s', addr[0], e)
+            return
+        if pdu.type in (TRAP_V1, TRAP_V2):
+            try:
+                self.callback(pdu, addr)
+            except Exception as e:
+                logger.exception(e)
+
+
+async def listen_traps(callback: Callable[[SnmpPDU, tuple[str, int]], Any],
+                       port: int = 162,
+                       host: str = '0.0.0.0') -> asyncio.DatagramTransport:
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: SnmpTrapProtocol(callback), local_addr=(host, port))
+    return transport
+
+
+class SnmpEngine:
+    def __init__(self, local_addr: tuple[str, int] = ('0.0.0.0', 0)):
+        self.local_addr = local_addr
+        self._transport: asyncio.DatagramTransport | None = None
+        self._open_lock = asyncio.Lock()
+        self._pending: dict[int, tuple[asyncio.Future, str]] = {}
+        self._request_id = random.randint(1, 1 << 30)
+        self.latencies: dict[str, float] = {}
+
+    async def _open(self) -> asyncio.DatagramTransport:
+        async with self._open_lock:
+            if self._transport is None or self._transport.is_closing():
+                loop = asyncio.get_running_loop()
+                self._transport, _ = await loop.create_datagram_endpoint(
+                    lambda: SnmpProtocol(self), local_addr=self.local_addr)
+        return self._transport
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def _next_request_id(self) -> int:
+        self._request_id = (self._request_id % 0x7fffffff) + 1
+        return self._request_id
+
+    def on_response(self, data: bytes, addr: tuple[str, int]):
+        try:
+            response = decode_message(data)
+        except Exception as e:
+            logger.debug('Invalid SNMP response from %s: %s', addr[0], e)
+            return
+        pending = self._pending.get(response.request_id)
+        if pending is None:
+            return
+        future, host = pending
+        if host == addr[0] and not future.done():
+            future.set_result(response)
+
+    async def request(self,
+                      host: str,
+                      community: str,
+                      pdu_type: int,
+                      varbinds: Sequence[tuple[str, Any]],
+                      error_status: int = 0,
+                      error_index: int = 0,
+                      timeout: float = 5,
+                      retries: int = 2,
+                      port: int = 161) -> list[SnmpVarbind]:
+        transport = await self._open()
+        loop = asyncio.get_running_loop()
+        for _ in range(int(retries) + 1):
+            request_id = self._next_request_id()
+            future = loop.create_future()
+            self._pending[request_id] = (future, host)
+            start_time = loop.time()
+            try:
+                transport.sendto(encode_message(community, pdu_type, request_id,
+                                                varbinds, error_status, error_index),
+                                 (host, port))
+                async with asyncio.timeout(timeout):
+                    response: SnmpPDU = await future
+            except TimeoutError:
+                continue
+            finally:
+                del self._pending[request_id]
+            self.latencies[host] = loop.time() - start_time
+            if response.error_status:
+                raise SnmpError(host, response.error_status, response.error_index)
+            return response.varbinds
+        raise TimeoutError(f'SNMP request to {host} timed out')
+
+
+class SnmpClient:
+    def __init__(self,
+                 engine: SnmpEngine,
+                 host: str,
+                 community: str,
+                 timeout: float = 5,
+                 retries: int = 2,
+                 port: int = 161):
+        self.engine = engine
+        self.host = host
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.port = port
+
+    @property
+    def latency(self) -> float | None:
+        return self.engine.latencies.get(self.host)
+
+    async def _request(self, pdu_type, varbinds, error_status=0, error_index=0):
+        return await self.engine.request(self.host, self.community, pdu_type, varbinds,
+                                         error_status, error_index,
+                                         timeout=self.timeout, retries=self.retries,
+                                         port=self.port)
+
+    async def get(self, oids: Sequence[str]) -> list[SnmpVarbind]:
+        return await self._request(GET_REQUEST, [(oid, None) for oid in oids])
+
+    async def get_bulk(self, oids: Sequence[str], non_repeaters: int = 0, max_repetitions: int = 10) -> list[SnmpVarbind]:
+        return await self._request(GET_BULK_REQUEST, [(oid, None) for oid in oids],
+                                   non_repeaters, max_repetitions)
+
+    async def set(self, varbinds: Sequence[tuple[str, Any]]) -> list[SnmpVarbind]:
+        return await self._request(SET_REQUEST, varbinds)
+
+
+snmp_engine = SnmpEngine()
@@ -4,12 +4,12 @@ import traceback
 from functools import cached_property
 from typing import Sequence
 
-import aiosnmp
-
 from misc import logger, memoize
 
 from .device import DeviceState
 from .icmpable import ICMPable
+from .mixins import PushMixin
+from .snmp import SnmpClient, SnmpVarbind, snmp_engine
 
 PDU_COMMUNITYSTRING = os.environ['PDU_COMMUNITYSTRING']
 
@@ -57,17 +57,23 @@ def get_port_state_oid(device_model):
             raise NotImplementedError(device_model)
 
 
-class GudePDU(ICMPable):
+class GudePDU(PushMixin, ICMPable):
     def __init__(self,
                  *args,
                  watch_interval: float = 10,
                  snmp_timeout: float = 5,
                  snmp_retries: float = 2,
                  write_powerfeeds_timeout: float = 900,
+                 write_coalesce_window: float = .2,
+                 reconcile_interval: float = 300,
+                 trap_timeout: float = 3600,
                  **kwargs):
         super().__init__(*args, **kwargs)
         self.intervals['watch'] = watch_interval
+        self.init_push('watch', reconcile_interval, trap_timeout)
+        self.intervals['write_coalesce'] = write_coalesce_window
         self.timeouts['write_powerfeeds'] = write_powerfeeds_timeout
+        self._pending_writes: dict[int, tuple[bool, list[asyncio.Future]]] = {}
 
         self.model = getattr(self, 'device_type')['model']
         try:
@@ -81,8 +87,9 @@ class GudePDU(ICMPable):
         self.event.append(self.online_event)
         ip = getattr(self, 'primary_ip')
         address = ip['address'].split('/')[0]
-        self.snmp_client = aiosnmp.Snmp(
-            host=address, community=PDU_COMMUNITYSTRING, timeout=snmp_timeout, retries=snmp_retries)
+        self.snmp_client = SnmpClient(
+            snmp_engine, address, PDU_COMMUNITYSTRING, timeout=snmp_timeout, retries=snmp_retries)
+        self.use_bulk = True
 
     @cached_property
     def num_powerfeeds(self):
@@ -101,16 +108,26 @@ class GudePDU(ICMPable):
         if event_type == 'is_online':
             if value == DeviceState.ON:
                 try:
-                    async with self.snmp_client as client:
-                        await self._read_powerfeeds(client)
+                    await self._read_powerfeeds()
                 except Exception as e:
                     logger.exception(self.name)
                     await self._handle_exception(e)
                     await self.set_is_online(DeviceState.PARTIAL)
 
-    async def _read_powerfeeds(self, client):
-        res = await client.get(self.port_state_oids)
+    async def _get_port_states(self):
+        if self.use_bulk:
+            res = await self.snmp_client.get_bulk([self.port_state_oid.rstrip('.')],
+                                                  max_repetitions=self.num_powerfeeds)
+            if [x.oid for x in res] == self.port_state_oids:
+                return res
+            logger.debug('%s: GETBULK returned unexpected OIDs, falling back to GET', self.name)
+            self.use_bulk = False
+        return await self.snmp_client.get(self.port_state_oids)
+
+    async def _read_powerfeeds(self):
+        res = await self._get_port_states()
         powerfeeds = [x.value == 1 for x in res]
+        await self.event('snmp_latency', round(self.snmp_client.latency * 1000, 1))
 
         changed = not all([a == b for a, b in zip(
             powerfeeds, self._state['powerfeeds'])])
@@ -118,54 +135,122 @@ class GudePDU(ICMPable):
             self._state['powerfeeds'] = powerfeeds
             await self.event('powerfeeds', self._state['powerfeeds'])
 
+    def on_trap(self, varbinds: list[SnmpVarbind]):
+        self.push(self._apply_trap, varbinds=varbinds)
+
+    async def _apply_trap(self, varbinds: list[SnmpVarbind]):
+        if 'powerfeeds' not in self._state:
+            return
+        powerfeeds = list(self._state['powerfeeds'])
+        is_port_state = False
+        for oid, value in varbinds:
+            if not oid.startswith(self.port_state_oid):
+                continue
+            try:
+                id = int(oid[len(self.port_state_oid):]) - 1
+            except ValueError:
+                continue
+            if 0 <= id < len(powerfeeds):
+                powerfeeds[id] = value == 1
+                is_port_state = True
+        if not is_port_state:
+            async with self.lock:
+                await self._read_powerfeeds()
+            return
+        logger.debug('%s trap powerfeeds %s', self.name, powerfeeds)
+        if powerfeeds != self._state['powerfeeds']:
+            self._state['powerfeeds'] = powerfeeds
+            await self.event('powerfeeds', self._state['powerfeeds'])
+
     @memoize('watch')
     async def _watch_powerfeeds(self):
+        self.check_push()
         if self.is_online == DeviceState.ON:
-            await self.lock.acquire()
-            try:
-                async with self.snmp_client as client:
-                    await self._read_powerfeeds(client)
-            except Exception as e:
-                await self._handle_exception(e)
-            self.lock.release()
-
-    async def _write_powerfeeds(self, powerfeeds=None):
-        if powerfeeds == None:
-            return
-        messages: Sequence = [(f'{self.port_state_oid}{i+1}', 1 if value else 0)
-                              for i, value in enumerate(powerfeeds)]
-        async with asyncio.timeout(self.timeouts['write_powerfeeds']):
-            while any([powerfeeds[i] != self._state['powerfeeds'][i] for i in range(self.num_powerfeeds)]):
-                await self.lock.acquire()
+            async with self.lock:
                 try:
-                    async with self.snmp_client as client:
-                        res = await client.set(messages)
-                        self._state['powerfeeds'] = [x.value == 1 for x in res]
-                        logger.debug('%s powerfeeds %s', self.name,
-                                     self._state['powerfeeds'])
-                        await self.event('powerfeeds', self._state['powerfeeds'])
+                    await self._read_powerfeeds()
                 except Exception as e:
                     await self._handle_exception(e)
-                    await asyncio.sleep(5)
-                self.lock.release()
 
-    async def write_powerfeed(self, id=None, value=None):
-        if id is None or value is None:
-            return
+    @property
+    def powerfeeds(self) -> list:
+        return self._state['powerfeeds']
 
-        while not self.is_ready:
-            await asyncio.sleep(1)
-        logger.debug('name=%s, id=%s, value=%s', self.name, id, value)
-        powerfeeds = [*self._state['powerfeeds']]
-        powerfeeds[id] = value
-        if '_write_powerfeeds' in self.tasks and not self.tasks['_write_powerfeeds'].done():
-            self.tasks['_write_powerfeeds'].cancel()
-            self.lock.release()
-        task = asyncio.create_task(self._try_method(
-            self._write_powerfeeds, powerfeeds=powerfeeds))
+    def _resolve_writes(self, writes: dict[int, tuple[bool, list[asyncio.Future]]], force=False):
+        for id in list(writes):
+            value, futures = writes[id]
+            state = self._state['powerfeeds'][id]
+            if force or state == value:
+                for future in futures:
+                    if not future.done():
+                        future.set_result(state)
+                del writes[id]
+
+    async def _write_powerfeeds(self):
+        writes: dict[int, tuple[bool, list[asyncio.Future]]] = {}
+        try:
+            async with asyncio.timeout(self.timeouts['write_powerfeeds']):
+                while True:
+                    await asyncio.sleep(self.intervals['write_coalesce'])
+                    for id, (value, futures) in self._pending_writes.items():
+                        writes[id] = (value, [*writes.get(id, (value, []))[1], *futures])
+                    self._pending_writes = {}
+                    self._resolve_writes(writes)
+                    if not writes:
+                        return
+                    ids = list(writes)
+                    messages: Sequence = [(f'{self.port_state_oid}{id+1}', 1 if writes[id][0] else 0)
+                                          for id in ids]
+                    async with self.lock:
+                        try:
+                            res = await self.snmp_client.set(messages)
+                            for id, varbind in zip(ids, res):
+                                self._state['powerfeeds'][id] = varbind.value == 1
+                            logger.debug('%s powerfeeds %s', self.name,
+                                         self._state['powerfeeds'])
+                            await self.event('powerfeeds', self._state['powerfeeds'])
+                        except Exception as e:
+                            await self._handle_exception(e)
+                    self._resolve_writes(writes)
+                    if writes:
+                        await asyncio.sleep(5)
+        finally:
+            self._resolve_writes(writes, force=True)
+
+    def _write_done(self, task):
+        if self.tasks.get('_write_powerfeeds') is task:
+            del self.tasks['_write_powerfeeds']
+        if self._pending_writes and not task.cancelled():
+            self._start_write()
+        else:
+            self._resolve_writes(self._pending_writes, force=True)
+
+    def _start_write(self):
+        task = asyncio.create_task(self._try_method(self._write_powerfeeds))
         self.tasks['_write_powerfeeds'] = task
-        task.add_done_callback(self._delete_task('_write_powerfeeds'))
-        return self._state['powerfeeds'][id] != value
+        task.add_done_callback(self._write_done)
+
+    async def write_powerfeed(self, id=None, value=None) -> asyncio.Future | None:
+        if id is None or value is None:
+            return None
+        logger.debug('name=%s, id=%s, value=%s', self.name, id, value)
+        future = asyncio.get_running_loop().create_future()
+        futures = self._pending_writes.get(id, (value, []))[1]
+        self._pending_writes[id] = (value, [*futures, future])
+        task = self.tasks.get('_write_powerfeeds')
+        if task is None or task.done():
+            self._start_write()
+        return future
+
+    def snapshot_state(self):
+        state = super().snapshot_state()
+        state['powerfeeds'] = self._state.get('powerfeeds', [])
+        return state
+
+    def restore_state(self, state):
+        if len(state.get('powerfeeds', [])) != len(self._state.get('powerfeeds', [])):
+            state = {key: value for key, value in state.items() if key != 'powerfeeds'}
+        super().restore_state(state)
 
     async def fetch(self):
         await super().fetch()
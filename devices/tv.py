@@ -3,14 +3,11 @@ from .device import DeviceState
 from .wolable import WOLable
 from misc import logger, memoize
 import asyncio
-import json
 
-from pywebostv import connection, controls
-import wsaccel
-wsaccel.patch_ws4py()
+from .webos import WebOSClient
 
 
-store = {}
+POWER_STATE_URI = 'ssap://com.webos.service.tvpower/power/getPowerState'
 
 
 class LGWebOSTV(WOLable):
@@ -27,7 +24,8 @@ class LGWebOSTV(WOLable):
         self.update_methods.append(('register_client', self.register_client))
         self.loop = asyncio.get_event_loop()
         self.ip = getattr(self, 'primary_ip')['address'].split('/')[0]
-        self.init_client()
+        self.webosclient = WebOSClient(self.ip, on_close=self.on_close)
+        self.power_subscription: str | None = None
 
     async def online_event(self, _, event_type, value):
         if event_type == 'is_online':
@@ -36,50 +34,42 @@ class LGWebOSTV(WOLable):
             if value == DeviceState.PARTIAL and not self.is_connected:
                 await self.try_connect()
 
-    def init_client(self):
-        self.webosclient = connection.WebOSClient(self.ip, secure=True)
-        logger.debug('webosclient created')
-        self.webosclient.closed = self.on_close
-        self.webosclient.opened = self.on_open
-        self.syscontrol = controls.SystemControl(self.webosclient)
-
     async def try_connect(self):
         if not self.is_connected:
             logger.debug('try_connect start, not connected')
             try:
-                logger.debug('try_connect webosclient connect')
-                async with asyncio.timeout(10):
-                    self.webosclient.connect()
+                await self.webosclient.connect()
+                self.on_open()
             except Exception as e:
-                self.webosclient.close()
+                await self.webosclient.close()
                 logger.exception(e)
 
     @memoize('ping')
     async def ping(self):
-        if self.is_online != DeviceState.ON:
-            if await ping_address(self.ip):
-                if not self.is_connected:
-                    await self.set_is_online(DeviceState.PARTIAL)
-            else:
-                logger.debug('fail')
-                await self.set_is_online(DeviceState.OFF)
+        if self.webosclient.is_subscribed(self.power_subscription):
+            return
+        if await ping_address(self.ip):
+            if not self.is_connected:
+                await self.set_is_online(DeviceState.PARTIAL)
+        else:
+            logger.debug('fail')
+            await self.set_is_online(DeviceState.OFF)
 
     @memoize('register')
     async def register_client(self):
-        if self.is_connected and not self.is_registered:
-            logger.debug('register...')
-            try:
-                with open('/opt/weboscreds.json', 'r+') as f:
-                    store = json.loads(f.read())
-                    list(self.webosclient.register(store, timeout=1))
-                    f.seek(0)
-                    f.write(json.dumps(store))
-                    f.truncate()
+        if not self.is_connected:
+            return
+        try:
+            if not self.is_registered:
+                logger.debug('register...')
+                await self.webosclient.register()
                 self.is_registered = True
                 logger.debug('registered!')
-            except Exception as e:
-                await self._handle_exception(e)
-                self.init_client()
+            if not self.webosclient.is_subscribed(self.power_subscription):
+                self.power_subscription = await self.webosclient.subscribe(POWER_STATE_URI, self.on_power_state)
+        except Exception as e:
+            await self._handle_exception(e)
+            await self.webosclient.close()
 
     @property
     def is_connected(self):
@@ -113,16 +103,27 @@ class LGWebOSTV(WOLable):
         logger.debug('try_connect webosclient connected')
         self.is_connected = True
 
+    def on_power_state(self, payload):
+        logger.debug('%s power state %s', self.name, payload)
+        if payload.get('state') == 'Active' and 'processing' not in payload:
+            is_online = DeviceState.ON
+        else:
+            is_online = DeviceState.PARTIAL
+        self.loop.create_task(self.set_is_online(is_online))
+
     def on_close(self, *_, **__):
         self.is_connected = False
-        self.init_client()
-
-    def on_shutdown_received(self, status, payload):
-        logger.debug('%s, %s', status, payload)
-        self.loop.create_task(self.set_should_shutdown(status))
+        if self.is_registered:
+            self.is_registered = False
 
     async def shutdown(self, *_, **__):
-        self.syscontrol.power_off(callback=self.on_shutdown_received)
+        try:
+            payload = await self.webosclient.request('ssap://system/turnOff')
+            logger.debug('%s', payload)
+            await self.set_should_shutdown(True)
+        except Exception as e:
+            await self._handle_exception(e)
+            await self.set_should_shutdown(False)
 
     async def fetch(self):
         await super().fetch()
@@ -0,0 +1,184 @@
+import os
+import json
+import copy
+import asyncio
+import itertools
+from typing import Any, Callable
+
+import aiohttp
+from pywebostv.connection import REGISTRATION_PAYLOAD
+
+from misc import logger
+
+
+WEBOS_CREDENTIALS_PATH = os.environ.get('WEBOS_CREDENTIALS_PATH', '/opt/weboscreds.json')
+
+
+class WebOSError(Exception):
+    pass
+
+
+class WebOSCredentialStore:
+    def __init__(self, path: str = WEBOS_CREDENTIALS_PATH):
+        self.path = path
+        self._store: dict[str, str] | None = None
+
+    def _load(self) -> dict[str, str]:
+        if self._store is None:
+            try:
+                with open(self.path) as f:
+                    self._store = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error('Could not read webOS credentials %s: %s', self.path, e)
+                self._store = {}
+        return self._store
+
+    def get(self, address: str) -> str | None:
+        store = self._load()
+        return store.get(address, store.get('client_key'))
+
+    def set(self, address: str, client_key: str):
+        store = self._load()
+        if store.get(address) == client_key:
+            return
+        store[address] = client_key
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(store, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error('Could not write webOS credentials %s: %s', self.path, e)
+
+
+credential_store = WebOSCredentialStore()
+
+_session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession()
+    return _session
+
+
+class WebOSClient:
+    def __init__(self,
+                 address: str,
+                 store: WebOSCredentialStore = credential_store,
+                 timeout: float = 10,
+                 heartbeat: float = 30,
+                 on_close: Callable | None = None,
+                 url: str | None = None):
+        self.address = address
+        self.store = store
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.on_close = on_close
+        self.url = url or f'wss://{address}:3001/'
+        self.ws: aiohttp.ClientWebSocketResponse | None = None
+        self._reader: asyncio.Task | None = None
+        self._ids = itertools.count(1)
+        self._waiters: dict[str, asyncio.Queue] = {}
+        self._subscriptions: dict[str, Callable[[dict], Any]] = {}
+
+    @property
+    def is_connected(self) -> bool:
+        return self.ws is not None and not self.ws.closed
+
+    async def connect(self):
+        async with asyncio.timeout(self.timeout):
+            self.ws = await get_session().ws_connect(self.url, ssl=False, heartbeat=self.heartbeat)
+        self._reader = asyncio.create_task(self._read(self.ws))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse):
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    data = json.loads(message.data)
+                except ValueError:
+                    continue
+                id = data.get('id')
+                if id in self._waiters:
+                    self._waiters[id].put_nowait(data)
+                elif id in self._subscriptions:
+                    if data.get('type') == 'error':
+                        logger.error('%s subscription %s: %s', self.address, id, data.get('error'))
+                        del self._subscriptions[id]
+                        continue
+                    try:
+                        self._subscriptions[id](data.get('payload', {}))
+                    except Exception as e:
+                        logger.exception(e)
+        finally:
+            if self.ws is ws:
+                self.ws = None
+            for queue in self._waiters.values():
+                queue.put_nowait(None)
+            self._subscriptions.clear()
+            if self.on_close is not None:
+                self.on_close()
+
+    def _next_id(self, type: str) -> str:
+        return f'{type}_{next(self._ids)}'
+
+    async def _send(self, id: str, type: str, uri: str | None = None, payload: dict | None = None):
+        if not self.is_connected:
+            raise ConnectionError(f'{self.address} is not connected')
+        message: dict[str, Any] = {'type': type, 'id': id}
+        if uri is not None:
+            message['uri'] = uri
+        if payload is not None:
+            message['payload'] = payload
+        await self.ws.send_str(json.dumps(message))
+
+    async def _exchange(self, type: str, uri: str | None = None, payload: dict | None = None,
+                        timeout: float | None = None, until: Callable[[dict], bool] = lambda _: True) -> dict:
+        queue: asyncio.Queue = asyncio.Queue()
+        id = self._next_id(type)
+        self._waiters[id] = queue
+        try:
+            await self._send(id, type, uri, payload)
+            async with asyncio.timeout(timeout or self.timeout):
+                while True:
+                    data = await queue.get()
+                    if data is None:
+                        raise ConnectionError(f'{self.address} connection closed')
+                    if data.get('type') == 'error':
+                        raise WebOSError(data.get('error'))
+                    if until(data):
+                        return data.get('payload', {})
+        finally:
+            del self._waiters[id]
+
+    async def request(self, uri: str, payload: dict | None = None, timeout: float | None = None) -> dict:
+        return await self._exchange('request', uri, payload, timeout)
+
+    async def subscribe(self, uri: str, callback: Callable[[dict], Any], payload: dict | None = None) -> str:
+        id = self._next_id('subscribe')
+        self._subscriptions[id] = callback
+        try:
+            await self._send(id, 'subscribe', uri, payload)
+        except Exception:
+            self._subscriptions.pop(id, None)
+            raise
+        return id
+
+    def is_subscribed(self, id: str | None) -> bool:
+        return self.is_connected and id in self._subscriptions
+
+    async def register(self, timeout: float = 60):
+        payload = copy.deepcopy(REGISTRATION_PAYLOAD)
+        client_key = self.store.get(self.address)
+        if client_key:
+            payload['client-key'] = client_key
+        payload = await self._exchange('register', payload=payload, timeout=timeout,
+                                       until=lambda data: data.get('type') == 'registered')
+        self.store.set(self.address, payload['client-key'])
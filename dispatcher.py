@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+from misc import logger
+
+
+class Dispatcher:
+    def __init__(self, workers: int = 32, maxsize: int = 256):
+        self.queues: list[asyncio.Queue] = [
+            asyncio.Queue(maxsize) for _ in range(workers)]
+        self.tasks: list[asyncio.Task] = []
+        self.processed = 0
+        self.backpressure = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._work(queue))
+                      for queue in self.queues]
+
+    def cancel(self):
+        [task.cancel() for task in self.tasks]
+
+    async def submit(self, key: Hashable, handler: Callable, *args: Any):
+        queue = self.queues[hash(key) % len(self.queues)]
+        if queue.full():
+            self.backpressure += 1
+            logger.warning('Dispatch queue full for %s, depth %s',
+                           key, self.depth)
+        await queue.put((handler, args))
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            handler, args = await queue.get()
+            try:
+                await handler(*args)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                queue.task_done()
+                self.processed += 1
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'workers': len(self.queues),
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'backpressure': self.backpressure
+        }
+
+    async def report(self, client, interval: float = 10, sources: dict[str, Callable[[], dict]] | None = None):
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            for name, source in (sources or {}).items():
+                stats[name] = source()
+            await client.publish_json('manager/dispatcher', stats)
+            self.max_depth = 0
@@ -0,0 +1,85 @@
+import time
+import ipaddress
+from typing import Hashable
+
+from misc import logger
+
+
+def power_panel(device) -> str | None:
+    for power_port in device.__dict__.get('power_ports') or []:
+        for power_feed in power_port['link_peers']:
+            power_panel = power_feed.get('power_panel')
+            if power_panel:
+                return power_panel['name']
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+    def update(self, rate: float, burst: float):
+        self._refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class CommandLimiter:
+    def __init__(self, rate: float = 4, burst: float = 4, group_by: str = 'none'):
+        self.buckets: dict[Hashable, TokenBucket] = {}
+        self.configure(rate, burst, group_by)
+
+    def configure(self, rate: float = 4, burst: float = 4, group_by: str = 'none', **__):
+        if rate <= 0 or burst < 1:
+            logger.error('Invalid command dispatch rate=%s burst=%s', rate, burst)
+            return
+        self.rate = rate
+        self.burst = burst
+        if group_by != getattr(self, 'group_by', None):
+            self.buckets.clear()
+        self.group_by = group_by
+        for bucket in self.buckets.values():
+            bucket.update(rate, burst)
+
+    def group(self, device) -> Hashable:
+        match self.group_by:
+            case 'pdu':
+                return power_panel(device)
+            case 'subnet':
+                primary_ip = device.__dict__.get('primary_ip')
+                if primary_ip:
+                    try:
+                        return ipaddress.ip_interface(primary_ip['address']).network
+                    except ValueError:
+                        pass
+        return None
+
+    def batches(self, devices: list) -> list[list]:
+        batches: dict[Hashable, list] = {}
+        for device in devices:
+            key = power_panel(device)
+            batches.setdefault(id(device) if key is None else key, []).append(device)
+        return list(batches.values())
+
+    def reserve(self, device) -> float:
+        key = self.group(device)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket.reserve()
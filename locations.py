@@ -1,8 +1,7 @@
 import asyncio
-import random
 from typing import Any, Callable
 from misc import logger
-from functools import cached_property
+from power_plan import PowerPlan
 
 
 class LocationState:
@@ -28,34 +27,33 @@ class Location:
         }
         self.has_calendar_event = False
         self.last_calendar_method: str | None = None
-        self.devices = [dev for dev in self.manager.devices.values(
-        ) if dev.location != None and dev.location['id'] == self.id]
 
     def set_data(self, data: dict[str, Any]):
         self.id = data['id']
         self.name = data['name']
         for key, value in data.items():
-            if key != 'tags':
+            if key not in ['tags', 'devices']:
                 setattr(self, key, value)
 
     def __contains__(self, item: dict):
         return getattr(self.manager, item['type'])[item['id']].is_located(self)
 
-    @cached_property
+    @property
+    def devices(self) -> list:
+        return self.manager.topology.location_devices(self.id)
+
+    @property
     def tags(self) -> list:
-        return [tag for tag in self.manager.tags.values()
-                if {'type': 'tags', 'id': tag.id} in self]
+        return [self.manager.tags_by_name[tag_name]
+                for tag_name in self.manager.topology.location_tag_names(self.id)
+                if tag_name in self.manager.tags_by_name]
 
     @property
     def is_online(self):
-        if len(self.devices) == 0:
-            return LocationState.OFFLINE
-
-        num_online_devices = sum(
-            [device.is_online == LocationState.ONLINE for device in self.devices])
+        num_online_devices = self.manager.topology.location_online_counts(self.id)[LocationState.ONLINE]
         if num_online_devices == 0:
             return LocationState.OFFLINE
-        elif num_online_devices == len(self.devices):
+        elif num_online_devices == len(self.manager.topology.location_members.get(self.id, {})):
             return LocationState.ONLINE
         else:
             return LocationState.PARTIAL
@@ -69,17 +67,38 @@ class Location:
             self._state['knx_switch'] = value
             await self.manager.location_event(self.id, 'knx_state', self.knx_state)
 
+    @property
+    def elements(self) -> list:
+        return [tag for tag in self.tags
+                if tag.description == self.manager.config['group_by_tag_description']['value']]
+
+    def plan(self) -> PowerPlan:
+        devices = {}
+        for element in self.elements:
+            for device in element.devices:
+                devices[device.id] = device
+        return PowerPlan(f'Location {self.name}', list(devices.values()), self.manager.limiter)
+
+    async def wake(self, from_knx=False, **__):
+        if from_knx and self.has_calendar_event and self.last_calendar_method == 'shutdown':
+            return
+        logger.debug('wake location %s', self.name)
+        await self.plan().wake()
+
+    async def shutdown(self, from_knx=False, **__):
+        if from_knx and self.has_calendar_event and self.last_calendar_method == 'shutdown':
+            return
+        logger.debug('shutdown location %s', self.name)
+        await self.plan().shutdown()
+
     def __getattr__(self, __name: str) -> Callable:
         async def method(from_knx=False, **kwargs):
             if from_knx and self.has_calendar_event and self.last_calendar_method == 'shutdown':
                 return
             logger.debug('%s location %s', __name, self.name)
-            elements = [tag for tag in self.tags
-                        if tag.description == self.manager.config['group_by_tag_description']['value']]
             async with asyncio.TaskGroup() as tg:
-                for element in elements:
+                for element in self.elements:
                     tg.create_task(getattr(element, __name)(**kwargs))
-                    await asyncio.sleep(random.random())
         return method
 
     async def fetch(self):
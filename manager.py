@@ -1,84 +1,305 @@
 import os
+import ssl
+import time
 import asyncio
-from typing import Any
+from typing import Any, Callable
 
-import requests
+import aiohttp
 import yaml
 
 from mqtt_client import Client
-from misc import get_config, logger, timed, get_device_class
+from misc import get_config, logger, get_device_class, backoff, fingerprint, read_snapshot, write_snapshot
+from scheduler import Scheduler
+from limiter import CommandLimiter
 from tags import Tag
+from topology import Topology
 from locations import Location
 import devices
 from devices import Device, ICMPable
+from devices.snmp import SnmpPDU, listen_traps
+from devices.snmp_gude import PDU_COMMUNITYSTRING
+from devices.pjlink import listen_notifications as listen_pjlink_notifications
+
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', './config/snapshot.json.gz')
 
 
 class Api:
-    def __init__(self):
+    def __init__(self,
+                 api_url: str | None = None,
+                 root_ca: str | None = None,
+                 timeout: float = 120,
+                 retries: int = 5):
         self.token = None
-        self.api_url = f'https://{os.environ["API_HOSTNAME"]}:443'
+        if api_url is None:
+            api_url = f'https://{os.environ["API_HOSTNAME"]}:443'
+        self.api_url = api_url
+        if root_ca is None:
+            root_ca = os.environ.get('API_ROOT_CA')
+        self.root_ca = root_ca
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.session: aiohttp.ClientSession | None = None
+        self.login_lock = asyncio.Lock()
+        self.validators: dict[str, tuple[str | None, str | None]] = {}
 
-    def login(self):
-        auth_data = {
-            'username': (None, os.environ['API_SYSTEM_USERNAME']),
-            'password': (None, os.environ['API_SYSTEM_PASSWORD'])
-        }
-        response = requests.request(
-            'POST',
-            f'{self.api_url}/auth/jwt/login',
-            files=auth_data,
-            verify=os.environ['API_ROOT_CA'])
-        self.token = response.json()['access_token']
-
-    def get(self, path):
-        headers = {
-            'authorization': f'Bearer {self.token}'
-        }
-        response = requests.get(
-            f'{self.api_url}{path}',
-            headers=headers,
-            verify=os.environ['API_ROOT_CA'],
-            timeout=120)
-        if response.status_code == 401:
-            self.login()
-            return self.get(path)
-        else:
-            return response
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            ssl_context = None
+            if self.api_url.startswith('https'):
+                ssl_context = ssl.create_default_context(cafile=self.root_ca)
+            connector = aiohttp.TCPConnector(
+                ssl=ssl_context, limit=8, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def login(self, expired_token=None):
+        async with self.login_lock:
+            if self.token != expired_token:
+                return
+            with aiohttp.MultipartWriter('form-data') as form:
+                for name, value in [('username', os.environ['API_SYSTEM_USERNAME']),
+                                    ('password', os.environ['API_SYSTEM_PASSWORD'])]:
+                    part = form.append(value)
+                    part.set_content_disposition('form-data', name=name)
+            async with self._get_session().post(
+                    f'{self.api_url}/auth/jwt/login', data=form) as response:
+                response.raise_for_status()
+                self.token = (await response.json())['access_token']
+
+    async def get(self, path, conditional=False):
+        for attempt in range(self.retries):
+            token = self.token
+            headers = {
+                'authorization': f'Bearer {token}'
+            }
+            if conditional and path in self.validators:
+                etag, last_modified = self.validators[path]
+                if etag is not None:
+                    headers['if-none-match'] = etag
+                if last_modified is not None:
+                    headers['if-modified-since'] = last_modified
+            try:
+                async with self._get_session().get(
+                        f'{self.api_url}{path}', headers=headers) as response:
+                    if response.status == 401:
+                        await self.login(expired_token=token)
+                        continue
+                    if response.status == 304:
+                        return None
+                    response.raise_for_status()
+                    result = await response.json()
+                    self.validators[path] = (response.headers.get('etag'),
+                                             response.headers.get('last-modified'))
+                    return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries - 1:
+                    raise
+                delay = backoff(attempt)
+                logger.warning('GET %s failed (%s), retrying in %.2f(s)',
+                               path, e, delay)
+                await asyncio.sleep(delay)
+        raise PermissionError(f'GET {path} unauthorized')
 
 
 class Manager:
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, refresh_attempts: int = 2):
         self.client = client
         self.api = Api()
+        self.refresh_attempts = refresh_attempts
         self.tasks: dict[str, asyncio.Task] = dict()
         self.lock = asyncio.Lock()
+        self.scheduler = Scheduler()
+        self.limiter = CommandLimiter()
+        self.devices: dict[int, Device] = {}
+        self.devices_by_name: dict[str, Device] = {}
+        self.devices_by_ip: dict[str, set[Device]] = {}
+        self.tags: dict[int, Tag] = {}
+        self.tags_by_name: dict[str, Tag] = {}
+        self.locations: dict[int, Location] = {}
+        self.topology = Topology()
+        self.busy_devices: set[int] = set()
+        self.idle_event = asyncio.Event()
+        self.idle_event.set()
+        self.fingerprints: dict[str, Any] = {}
+        self.inventory: dict[str, list] | None = None
+        self.failed_records = 0
+        self.is_refresh_due = False
+        self.trap_transport: asyncio.DatagramTransport | None = None
+        self.pjlink_transport: asyncio.DatagramTransport | None = None
 
     async def setup(self, initial=False):
         self.config = get_config()
         self.device_map = self.config['device_map']
-        await self.lock.acquire()
-        try:
-            response = self.api.get('/api/')
+        self.limiter.configure(**self.config.get('command_dispatch', {}))
+        if initial and await self.load_snapshot():
+            self.refresh()
+            return
+        start_time = time.perf_counter()
+        attempt = 0
+        while True:
             try:
-                response = response.json()
+                response = await self.api.get('/api/', conditional=not initial)
+                if response is not None:
+                    devices = response['devices']
+                    tags = response['tags']
+                    locations = response['locations']
+                break
             except Exception as e:
                 logger.exception(e)
-                logger.error(response)
-                exit(1)
-            devices = response['devices']
-            tags = response['tags']
-            locations = response['locations']
-            if initial:
-                self.devices: dict[int, Device] = {}
-                self.tags: dict[int, Tag] = {}
-                self.locations: dict[int, Location] = {}
-            await self.subscribe_devices(devices)
-            await self.subscribe_tags(tags)
-            await self.subscribe_locations(locations)
+                if self.inventory is not None and attempt + 1 >= self.refresh_attempts:
+                    logger.error('Fetching inventory failed %s times, keeping the last inventory',
+                                 attempt + 1)
+                    return
+                delay = backoff(attempt)
+                attempt += 1
+                logger.error('Fetching inventory failed, retrying in %.2f(s)', delay)
+                await asyncio.sleep(delay)
+        if response is None:
+            if self.inventory is None or (not self.failed_records
+                                          and self.config_fingerprint() == self.fingerprints.get('config')):
+                logger.debug('Inventory not modified, took %.2f(s)',
+                             time.perf_counter() - start_time)
+                return
+            devices = self.inventory['devices']
+            tags = self.inventory['tags']
+            locations = self.inventory['locations']
+        async with self.lock:
+            report = await self.apply_inventory(devices, tags, locations)
+        self.inventory = {'devices': devices, 'tags': tags, 'locations': locations}
+        report['duration'] = time.perf_counter() - start_time
+        logger.info('Inventory refresh: %s', report)
+        await self.client.publish_json('manager/refresh', report)
+        await self.save_snapshot()
+
+    def refresh(self):
+        if 'setup' in self.tasks:
+            self.is_refresh_due = True
+            return
+        task = asyncio.create_task(self.setup())
+        self.tasks['setup'] = task
+        task.add_done_callback(self._setup_done)
+
+    def _setup_done(self, task: asyncio.Task):
+        self.delete_task('setup')(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Inventory refresh failed', exc_info=task.exception())
+        if self.is_refresh_due:
+            self.is_refresh_due = False
+            self.refresh()
+
+    async def load_snapshot(self) -> bool:
+        start_time = time.perf_counter()
+        fingerprints = {kind: dict(value) if isinstance(value, dict) else value
+                        for kind, value in self.fingerprints.items()}
+        try:
+            snapshot = await asyncio.to_thread(read_snapshot, SNAPSHOT_PATH)
+            inventory = snapshot['inventory']
+            async with self.lock:
+                await self.apply_inventory(**inventory, states=snapshot['states'])
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.exception(e)
+            self.fingerprints = fingerprints
+            return False
+        self.inventory = inventory
+        logger.info('Restored %s devices from snapshot in %.3f(s)',
+                    len(self.devices), time.perf_counter() - start_time)
+        return True
+
+    async def save_snapshot(self):
+        if self.inventory is None:
+            return
+        snapshot = {
+            'time': time.time(),
+            'inventory': self.inventory,
+            'states': {str(device_id): device.snapshot_state()
+                       for device_id, device in self.devices.items()}
+        }
+        try:
+            await asyncio.to_thread(write_snapshot, SNAPSHOT_PATH, snapshot)
         except Exception as e:
             logger.exception(e)
-            await self.setup()
-        self.lock.release()
+
+    async def save_snapshots(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            await self.save_snapshot()
+
+    def _diff(self, kind: str, records: list[dict], force=False):
+        previous = self.fingerprints.get(kind, {})
+        current = {}
+        added, changed = [], []
+        for record in records:
+            record_fingerprint = fingerprint(record)
+            current[record['id']] = record_fingerprint
+            if record['id'] not in previous:
+                added.append((record, record_fingerprint))
+            elif force or previous[record['id']] != record_fingerprint:
+                changed.append((record, record_fingerprint))
+        removed = [record_id for record_id in previous
+                   if record_id not in current]
+        return added, changed, removed
+
+    async def _apply(self, kind: str, records: list[dict], subscribe: Callable, unsubscribe: Callable, force=False):
+        fingerprints = self.fingerprints.setdefault(kind, {})
+        added, changed, removed = self._diff(kind, records, force=force)
+        failed = 0
+        for record_id in removed:
+            try:
+                await unsubscribe(record_id)
+            except Exception as e:
+                logger.exception(e)
+                failed += 1
+                continue
+            del fingerprints[record_id]
+        for record, record_fingerprint in [*added, *changed]:
+            try:
+                await subscribe(record)
+            except Exception as e:
+                logger.exception(e)
+                failed += 1
+                fingerprints.pop(record['id'], None)
+                continue
+            fingerprints[record['id']] = record_fingerprint
+        return {'added': len(added), 'changed': len(changed), 'removed': len(removed), 'failed': failed}
+
+    def config_fingerprint(self) -> bytes:
+        return fingerprint([self.config['device_map'], self.config['device_options']])
+
+    async def _unsubscribe_device(self, device_id):
+        if device_id in self.devices:
+            await self.unsubscribe_device(device_id)
+
+    async def _unsubscribe_tag(self, tag_id):
+        if tag_id in self.tags:
+            self.unsubscribe_tag(tag_id)
+
+    async def _unsubscribe_location(self, location_id):
+        self.locations.pop(location_id, None)
+
+    async def apply_inventory(self, devices, tags, locations, states=None):
+        config_fingerprint = self.config_fingerprint()
+        force = config_fingerprint != self.fingerprints.get('config')
+
+        report = {}
+        report['devices'] = await self._apply('devices', devices, self.subscribe_device,
+                                              self._unsubscribe_device, force=force)
+        if states is not None:
+            for device_id, device in self.devices.items():
+                if str(device_id) in states:
+                    device.restore_state(states[str(device_id)])
+        report['tags'] = await self._apply('tags', tags, self.subscribe_tag, self._unsubscribe_tag)
+        report['locations'] = await self._apply('locations', locations, self.subscribe_location,
+                                                self._unsubscribe_location)
+        self.failed_records = sum(counts['failed'] for counts in report.values())
+        self.fingerprints['config'] = config_fingerprint
+        return report
 
     def delete_task(self, task_name):
         def wrap(_):
@@ -88,23 +309,64 @@ class Manager:
                 pass
         return wrap
 
-    @timed(.125)
-    async def update_devices(self):
-        for device in self.devices.values():
-            if device.name not in self.tasks:
-                task = asyncio.create_task(device.update())
-                self.tasks[device.name] = task
-                task.add_done_callback(self.delete_task(device.name))
-
     async def start(self):
-        while True:
-            await self.lock.acquire()
-            await self.update_devices()
-            self.lock.release()
+        self.scheduler.start()
+        await self.listen_traps()
+        await self.listen_pjlink_notifications()
+        await self.save_snapshots()
+
+    async def listen_traps(self):
+        port = self.config.get('snmp_trap_port', 162)
+        if not port:
+            return
+        try:
+            self.trap_transport = await listen_traps(self.on_trap, port=port)
+        except OSError as e:
+            logger.error('Could not listen for SNMP traps on port %s: %s', port, e)
+
+    async def listen_pjlink_notifications(self):
+        port = self.config.get('pjlink_notification_port', 4352)
+        if not port:
+            return
+        try:
+            self.pjlink_transport = await listen_pjlink_notifications(self.on_pjlink_notification, port=port)
+        except OSError as e:
+            logger.error('Could not listen for PJLink notifications on port %s: %s', port, e)
+
+    def devices_at(self, address: str, device_class: type) -> list:
+        return [device for device in self.devices_by_ip.get(address, ())
+                if isinstance(device, device_class)]
+
+    def on_pjlink_notification(self, message: str, address: tuple[str, int]):
+        targets = self.devices_at(address[0], devices.PJLink)
+        if not targets:
+            logger.debug('PJLink notification from unknown device %s', address[0])
+        for device in targets:
+            device.on_notification(message)
+
+    def on_trap(self, pdu: SnmpPDU, address: tuple[str, int]):
+        if pdu.community != PDU_COMMUNITYSTRING.encode():
+            logger.debug('SNMP trap from %s with wrong community dropped', address[0])
+            return
+        targets = self.devices_at(address[0], devices.GudePDU)
+        if not targets:
+            logger.debug('SNMP trap from unknown device %s', address[0])
+        for device in targets:
+            device.on_trap(pdu.varbinds)
 
     async def idle(self):
-        while not all([device.is_idle() for device in self.devices.values()]):
-            await asyncio.sleep(1)
+        await self.idle_event.wait()
+
+    def _update_busy(self, device_id: int):
+        device = self.devices.get(device_id)
+        if device is None or device.is_idle():
+            self.busy_devices.discard(device_id)
+        else:
+            self.busy_devices.add(device_id)
+        if self.busy_devices:
+            self.idle_event.clear()
+        else:
+            self.idle_event.set()
 
     async def on_message(self, topic, payload):
         ...
@@ -128,20 +390,47 @@ class Manager:
         )
         device_options = self.config['device_options'].get(device_class_name, {})
         if device_id in self.devices and device_class != type(self.devices[device_id]):
-            await self.devices[device_id].cancel()
-            del self.devices[device_id]
+            await self.unsubscribe_device(device_id)
         if device_id not in self.devices:
             self.devices[device_id] = device_class(
                 self, self.client, self.device_event, **device, **device_options)
             act = 'Subscribed'
         else:
+            self.unindex_device(self.devices[device_id])
             self.devices[device_id].set_data(**device_options,
                                              **device)
             act = 'Updated'
+        self.index_device(self.devices[device_id])
         await self.devices[device_id].setup()
+        if act == 'Subscribed':
+            self.scheduler.add_device(self.devices[device_id])
         logger.debug(f'{act} device: %s %s %s',
                      device_class.__name__, device_id, device_name)
 
+    async def unsubscribe_device(self, device_id):
+        device = self.devices.pop(device_id)
+        self.unindex_device(device)
+        self.scheduler.remove_device(device)
+        self._update_busy(device_id)
+        await device.cancel()
+
+    def index_device(self, device: Device):
+        self.devices_by_name[device.name] = device
+        if device.address is not None:
+            self.devices_by_ip.setdefault(device.address, set()).add(device)
+        self.topology.add_device(device)
+
+    def unindex_device(self, device: Device):
+        if self.devices_by_name.get(device.name) is device:
+            del self.devices_by_name[device.name]
+        shared = self.devices_by_ip.get(device.address)
+        if shared is not None:
+            shared.discard(device)
+            if not shared:
+                del self.devices_by_ip[device.address]
+        if self.topology.devices.get(device.id) is device:
+            self.topology.remove_device(device.id)
+
     async def subscribe_tags(self, tags):
         if isinstance(tags, list):
             for tag in tags:
@@ -155,11 +444,18 @@ class Manager:
             self.tags[tag_id] = Tag(self, **tag)
             act = 'Subscribed'
         else:
+            self.tags_by_name.pop(self.tags[tag_id].name, None)
             self.tags[tag_id].set_data(tag)
             act = 'Updated'
+        self.tags_by_name[self.tags[tag_id].name] = self.tags[tag_id]
         logger.debug(f'{act} tag: %s %s',
                      tag_id, tag['name'])
 
+    def unsubscribe_tag(self, tag_id):
+        tag = self.tags.pop(tag_id)
+        if self.tags_by_name.get(tag.name) is tag:
+            del self.tags_by_name[tag.name]
+
     async def subscribe_locations(self, locations):
         if isinstance(locations, list):
             for location in locations:
@@ -192,14 +488,16 @@ class Manager:
     async def device_event(self, target: int, event_type: str, payload: Any):
         event = self.make_event(target, event_type, payload)
         await self.client.publish_json('manager/device_event', event)
+        if event_type.startswith('should'):
+            self._update_busy(target)
         if event_type == 'is_online':
-            tags = [tag for tag in self.tags.values() if target in tag]
-            for tag in tags:
-                await self.tag_event(tag.id, event_type, tag.is_online)
-            location = [
-                location for location in self.locations.values() if {'id': target, 'type': 'devices'} in location]
-            if len(location):
-                await self.location_event(location[0].id, event_type, location[0].is_online)
+            for tag_name in self.topology.device_tag_names(target):
+                tag = self.tags_by_name.get(tag_name)
+                if tag is not None:
+                    await self.tag_event(tag.id, event_type, tag.is_online)
+            location = self.locations.get(self.topology.device_location_id(target))
+            if location is not None:
+                await self.location_event(location.id, event_type, location.is_online)
 
     async def tag_event(self, target: int, event_type: str, payload: Any):
         event = self.make_event(target, event_type, payload)
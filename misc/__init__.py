@@ -1,4 +1,7 @@
 import os
+import json
+import gzip
+import hashlib
 import shutil
 import time
 import logging
@@ -69,6 +72,28 @@ class BroadcastEvent(list):
             await callback(self._id, *args, **kwargs)
 
 
+def fingerprint(record: Any) -> bytes:
+    return hashlib.blake2b(
+        json.dumps(record, sort_keys=True, default=str).encode(),
+        digest_size=16).digest()
+
+
+def read_snapshot(path: str) -> Any:
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+
+def write_snapshot(path: str, data: Any):
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', compresslevel=1) as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def backoff(attempt: int, base: float = 1, cap: float = 60) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
 def run_in_thread(fn):
     async def run(*k, **kw):
         t = threading.Thread(target=fn, args=k, kwargs=kw, daemon=True)
@@ -95,67 +120,69 @@ def timed(interval: float) -> Callable:
     return decorator
 
 
-last_called_dict = {}
+class CallState:
+    __slots__ = ('time', 'result', 'immediate', 'is_running', 'is_timeout')
+
+    def __init__(self):
+        self.time = float('-inf')
+        self.result: Any = None
+        self.immediate = False
+        self.is_running = False
+        self.is_timeout = True
 
 
 def memoize(interval_key: str, immediate_key='') -> Callable:
     def decorator(func):
-        async def wrapper(self, *args, **kwargs) -> tuple[str, Any]:
+        state_key = func.__name__
+        result_name = func.__name__
+
+        async def wrapper(self, *args, scheduled=False, **kwargs) -> tuple[str, Any]:
             interval = self.intervals[interval_key]
-            func_hash = self.name + func.__name__
-            if func_hash not in last_called_dict:
-                last_called_dict[func_hash] = {
-                        'time': time.time() + random.random() * interval,
-                        'result': None,
-                        'immediate': False,
-                        'is_running': False
-                        }
-            last_called = last_called_dict[func_hash]
-            if last_called['is_running']:
-                return last_called['result']
-            now = time.time()
+            now = time.monotonic()
+            state = self.call_states.get(state_key)
+            if state is None:
+                state = self.call_states[state_key] = CallState()
+            if state.is_running:
+                return state.result
             immediate = False
             if immediate_key:
                 immediate = getattr(self, immediate_key)
-            is_immediate = immediate != last_called['immediate'] and immediate
-            if now - last_called['time'] > interval or (is_immediate and not last_called['immediate']):
-                last_called['immediate'] = immediate
-                last_called['time'] = now
+            is_immediate = immediate != state.immediate and immediate
+            if scheduled or now - state.time >= interval or (is_immediate and not state.immediate):
+                state.immediate = immediate
+                state.time = now
+                state.is_running = True
                 try:
-                    last_called['is_running'] = True
-                    result: Any = await func(self, *args, **kwargs)
-                    last_called['result'] = result
-                except:
-                    raise
+                    state.result = await func(self, *args, **kwargs)
                 finally:
-                    last_called['is_running'] = False
-            return (func.__name__, last_called['result'])
+                    state.is_running = False
+            return (result_name, state.result)
         wrapper.__name__ = 'memoize_' + func.__name__
+        wrapper.interval_key = interval_key
         return wrapper
     return decorator
 
 
-is_timeout_dict = {}
-
-
 class MethodCanceled(Exception):
     pass
 
 
 def timeout(method_key: str):
     def decorator(func) -> Callable:
+        state_key = 'timeout_' + method_key
+
         async def wrapper(self, *args, **kwargs) -> Any:
-            func_hash = self.name + method_key
-            if func_hash not in is_timeout_dict:
-                is_timeout_dict[func_hash] = True
+            state = self.call_states.get(state_key)
+            if state is None:
+                state = self.call_states[state_key] = CallState()
             timeout_sec = self.timeouts[method_key]
             start_time = self.start_times[method_key]
-            current_time = time.time()
+            current_time = time.monotonic()
             running_time = current_time - start_time
             should = getattr(self, f'should_{method_key}')
             is_timeout = should and running_time > timeout_sec
-            if is_timeout != is_timeout_dict[func_hash]:
-                is_timeout_dict[func_hash] = is_timeout
+            if is_timeout != state.is_timeout:
+                state.is_timeout = is_timeout
                 if is_timeout:
                     logger.debug('Timeout %s %s after %.2f(s)',
                                  method_key, self.name, running_time)
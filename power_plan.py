@@ -0,0 +1,204 @@
+import time
+import asyncio
+from typing import Callable
+
+from devices.state import DeviceState
+from misc import logger
+from limiter import CommandLimiter
+
+
+POWER_SETTLE_TIME = 10
+
+
+def is_pdu(role: str) -> bool:
+    return role == 'PDU'
+
+
+def is_network_switch(role: str) -> bool:
+    return role == 'Netzwerkswitch'
+
+
+def is_display_device(role: str) -> bool:
+    return role in ['Monitor', 'Projektor']
+
+
+def is_computer(role: str) -> bool:
+    return 'Medienstation' in role
+
+
+def is_other_device(role: str) -> bool:
+    return not (is_pdu(role) or is_network_switch(role)
+                or is_display_device(role) or is_computer(role))
+
+
+class PowerPlan:
+    def __init__(self, name: str, devices: list, limiter: CommandLimiter):
+        self.name = name
+        self.devices = devices
+        self.limiter = limiter
+
+    def _roles(self, match: Callable[[str], bool]) -> list:
+        return [device for device in self.devices if match(device.role)]
+
+    @property
+    def network_switches(self) -> list:
+        return self._roles(is_network_switch)
+
+    def dependencies(self) -> dict[int, set[int]]:
+        devices_by_name = {device.name: device for device in self.devices}
+        switches = self.network_switches
+        dependencies = {}
+        for device in self.devices:
+            prerequisites = set()
+            for power_port in device.__dict__.get('power_ports') or []:
+                for power_feed in power_port['link_peers']:
+                    power_panel = power_feed.get('power_panel') or {}
+                    pdu = devices_by_name.get(power_panel.get('name'))
+                    if pdu is not None and pdu is not device:
+                        prerequisites.add(pdu.id)
+            if not (is_pdu(device.role) or is_network_switch(device.role)):
+                tag_names = {tag['name'] for tag in device.tags}
+                shared = [switch for switch in switches
+                          if tag_names & {tag['name'] for tag in switch.tags}]
+                prerequisites.update(switch.id for switch in shared or switches)
+            dependencies[device.id] = prerequisites
+        return self._break_cycles(dependencies)
+
+    def _break_cycles(self, dependencies: dict[int, set[int]]) -> dict[int, set[int]]:
+        remaining = {id: set(prerequisites) for id, prerequisites in dependencies.items()}
+        while remaining:
+            ready = [id for id, prerequisites in remaining.items()
+                     if not prerequisites & remaining.keys()]
+            if not ready:
+                logger.error('%s dependency cycle between %s', self.name, list(remaining))
+                for id in remaining:
+                    dependencies[id] = dependencies[id] - remaining.keys()
+                break
+            for id in ready:
+                del remaining[id]
+        return dependencies
+
+    async def _execute(self, dependencies: dict[int, set[int]], action: Callable):
+        devices = {device.id: device for device in self.devices}
+        done = {id: asyncio.Event() for id in dependencies}
+
+        async def run(id):
+            try:
+                for prerequisite in dependencies[id]:
+                    await done[prerequisite].wait()
+                await action(devices[id])
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                done[id].set()
+
+        async with asyncio.TaskGroup() as tg:
+            for id in dependencies:
+                tg.create_task(run(id))
+
+    async def _call(self, device, method_name, delay):
+        await asyncio.sleep(delay)
+        await getattr(device, method_name)()
+
+    async def call(self, devices, method_name):
+        devices = [d for d in devices if method_name in d.capabilities]
+        async with asyncio.TaskGroup() as tg:
+            for device in devices:
+                tg.create_task(self._call(device, method_name, self.limiter.reserve(device)))
+        if len(devices):
+            logger.debug('%s %s for %s', self.name,
+                         method_name, [d.name for d in devices])
+
+    async def wait_for(self, devices, *states, timeout=None):
+        if timeout is None:
+            timeout = max([max(device.timeouts.values())
+                          for device in devices])
+        try:
+            async with asyncio.timeout(timeout):
+                async with asyncio.TaskGroup() as tg:
+                    [tg.create_task(d.wait_for(*states)) for d in devices]
+        except Exception as e:
+            logger.exception(e)
+
+    async def call_and_wait_for(self, devices, method_name, *states):
+        await self.call(devices, method_name)
+        try:
+            timeout = max([device.timeouts[method_name]
+                          for device in devices if method_name in device.timeouts])
+        except:
+            timeout = 300
+        await self.wait_for(devices, *states, timeout=timeout)
+
+    async def _set_power(self, devices, state: bool, delay: float) -> bool:
+        await asyncio.sleep(delay)
+        has_switched = await asyncio.gather(
+            *[device.set_power(state, wait=True) for device in devices])
+        return any(has_switched)
+
+    async def power_outlets(self, devices, state: bool, timeout=300):
+        devices = [d for d in devices if d.__dict__.get('power_ports')]
+        if not devices:
+            return False
+        try:
+            async with asyncio.timeout(timeout):
+                has_switched = await asyncio.gather(
+                    *[self._set_power(batch, state, self.limiter.reserve(batch[0]))
+                      for batch in self.limiter.batches(devices)])
+        except Exception as e:
+            logger.exception(e)
+            return True
+        return any(has_switched)
+
+    def _timeout(self, device, method_name) -> float:
+        return device.timeouts.get(method_name, 300)
+
+    async def wake(self):
+        method_name = 'wake'
+        start_time = time.perf_counter()
+        dependencies = self.dependencies()
+        has_dependents = set().union(*dependencies.values())
+        pdus = self._roles(is_pdu)
+        if len(pdus):
+            await self.call_and_wait_for(pdus, method_name, DeviceState.ON)
+            logger.debug('%s PDUs are ON', self.name)
+        devices = [d for d in self.devices
+                   if not is_pdu(d.role) and method_name in d.capabilities]
+        if await self.power_outlets(devices, True):
+            logger.debug('%s Outlets are ON', self.name)
+            await asyncio.sleep(POWER_SETTLE_TIME)
+
+        async def wake_device(device):
+            if is_pdu(device.role):
+                return
+            await self.call([device], method_name)
+            if device.id in has_dependents:
+                await self.wait_for([device], DeviceState.ON,
+                                    timeout=self._timeout(device, method_name))
+                logger.debug('%s %s is ON', self.name, device.name)
+
+        await self._execute(dependencies, wake_device)
+        logger.info('%s wake of %s devices took %.1fs', self.name,
+                    len(self.devices), time.perf_counter() - start_time)
+
+    async def shutdown(self):
+        method_name = 'shutdown'
+        start_time = time.perf_counter()
+        dependents = {device.id: set() for device in self.devices}
+        for id, prerequisites in self.dependencies().items():
+            for prerequisite in prerequisites:
+                dependents[prerequisite].add(id)
+
+        async def shutdown_device(device):
+            if is_computer(device.role):
+                states = [DeviceState.OFF]
+            elif is_display_device(device.role):
+                states = [DeviceState.OFF, DeviceState.PARTIAL]
+            else:
+                await self.call([device], method_name)
+                return
+            await self.call_and_wait_for([device], method_name, *states)
+            logger.debug('%s %s is OFF', self.name, device.name)
+
+        await self._execute(dependents, shutdown_device)
+        logger.info('%s shutdown of %s devices took %.1fs', self.name,
+                    len(self.devices), time.perf_counter() - start_time)
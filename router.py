@@ -0,0 +1,100 @@
+import json
+from typing import Any, Callable, Hashable
+
+from misc import logger
+from dispatcher import Dispatcher
+
+
+_HANDLER = None
+
+
+class Route:
+    __slots__ = ('handler', 'parse_json', 'key')
+
+    def __init__(self, handler: Callable, parse_json: bool = True, key: Callable | None = None):
+        self.handler = handler
+        self.parse_json = parse_json
+        self.key = key
+
+
+class Router:
+    def __init__(self, dispatcher: Dispatcher | None = None, cache_size: int = 4096):
+        self.dispatcher = dispatcher
+        self._root: dict = {}
+        self._cache: dict[str, tuple[Route, list[str]] | None] = {}
+        self._cache_size = cache_size
+
+    def route(self, pattern: str, parse_json: bool = True, key: Callable | None = None) -> Callable:
+        def decorator(handler):
+            self.add(pattern, handler, parse_json=parse_json, key=key)
+            return handler
+        return decorator
+
+    def add(self, pattern: str, handler: Callable, parse_json: bool = True, key: Callable | None = None):
+        node = self._root
+        for segment in pattern.split('/'):
+            node = node.setdefault(segment, {})
+        node[_HANDLER] = Route(handler, parse_json, key)
+        self._cache.clear()
+
+    def _match(self, node: dict, segments: list[str], i: int) -> Route | None:
+        if i == len(segments):
+            return node.get(_HANDLER) or node.get('#', {}).get(_HANDLER)
+        segment = segments[i]
+        if segment in node:
+            route = self._match(node[segment], segments, i + 1)
+            if route is not None:
+                return route
+        if '+' in node:
+            route = self._match(node['+'], segments, i + 1)
+            if route is not None:
+                return route
+        if '#' in node:
+            return node['#'].get(_HANDLER)
+        return None
+
+    def resolve(self, topic: str) -> tuple[Route, list[str]] | None:
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        segments = topic.split('/')
+        route = self._match(self._root, segments, 0)
+        resolved = (route, segments) if route is not None else None
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[topic] = resolved
+        return resolved
+
+    async def dispatch(self, topic: str, payload: bytes | bytearray | str) -> bool:
+        resolved = self.resolve(topic)
+        if resolved is None:
+            return False
+        route, segments = resolved
+        data: Any
+        if route.parse_json:
+            try:
+                data = json.loads(payload)
+            except Exception:
+                data = {}
+        elif isinstance(payload, (bytes, bytearray)):
+            data = payload.decode()
+        else:
+            data = payload
+        if self.dispatcher is not None:
+            await self.dispatcher.submit(self._key(route, segments, data, topic),
+                                         route.handler, segments, data)
+            return True
+        try:
+            await route.handler(segments, data)
+        except Exception as e:
+            logger.exception(e)
+        return True
+
+    def _key(self, route: Route, segments: list[str], data: Any, topic: str) -> Hashable:
+        if route.key is None:
+            return topic
+        try:
+            return route.key(segments, data)
+        except Exception:
+            return topic
@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import itertools
+import random
+from typing import Callable
+
+from misc import logger
+
+
+class Job:
+    __slots__ = ('device', 'name', 'method', 'interval_key', 'cancelled', 'is_running', 'is_due')
+
+    def __init__(self, device, name: str, method: Callable):
+        self.device = device
+        self.name = name
+        self.method = method
+        self.interval_key = getattr(method, 'interval_key', None)
+        self.cancelled = False
+        self.is_running = False
+        self.is_due = False
+
+    @property
+    def interval(self) -> float:
+        return self.device.intervals.get(self.interval_key, 1)
+
+
+class Scheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int, Job]] = []
+        self._counter = itertools.count()
+        self._jobs: dict[int, list[Job]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.fired = 0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._arm()
+
+    def add_device(self, device):
+        self.remove_device(device)
+        now = self._time()
+        jobs = [Job(device, name, method)
+                for name, method in device.update_methods]
+        self._jobs[id(device)] = jobs
+        for job in jobs:
+            self._push(job, now + random.random() * job.interval)
+
+    def remove_device(self, device):
+        for job in self._jobs.pop(id(device), []):
+            job.cancelled = True
+
+    def run_now(self, device, method: Callable):
+        jobs = self._jobs.get(id(device), [])
+        for i, job in enumerate(jobs):
+            if job.method != method:
+                continue
+            if job.is_running:
+                job.is_due = True
+            else:
+                job.cancelled = True
+                jobs[i] = Job(device, job.name, job.method)
+                self._push(jobs[i], self._time())
+
+    def _time(self) -> float:
+        if self._loop is None:
+            return asyncio.get_running_loop().time()
+        return self._loop.time()
+
+    def _push(self, job: Job, deadline: float):
+        is_head = not self._heap or deadline < self._heap[0][0]
+        heapq.heappush(self._heap, (deadline, next(self._counter), job))
+        if is_head:
+            self._arm()
+
+    def _arm(self):
+        if self._loop is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+        if self._heap:
+            self._timer = self._loop.call_at(self._heap[0][0], self._fire)
+
+    def _fire(self):
+        self._timer = None
+        now = self._time()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            self.fired += 1
+            job.is_running = True
+            try:
+                if job.interval_key is None:
+                    task = job.device.run_update(job.name, job.method)
+                else:
+                    task = job.device.run_update(job.name, job.method, scheduled=True)
+                task.add_done_callback(self._reschedule(job))
+            except Exception as e:
+                logger.exception(e)
+                job.is_running = False
+                self._push(job, now + job.interval)
+        self._arm()
+
+    def _reschedule(self, job: Job) -> Callable:
+        def wrap(_):
+            job.is_running = False
+            if job.cancelled:
+                return
+            if job.is_due:
+                job.is_due = False
+                self._push(job, self._time())
+            else:
+                self._push(job, self._time() + job.interval)
+        return wrap
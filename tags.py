@@ -1,8 +1,8 @@
 import asyncio
-import random
 from typing import Any, Callable
 from devices.device import Device
 from devices.state import DeviceState
+from power_plan import PowerPlan, is_pdu, is_network_switch, is_display_device, is_computer, is_other_device
 
 from misc import logger
 
@@ -29,118 +29,65 @@ class Tag:
         self.name = data['name']
         self.description = data['description']
         for key, value in data.items():
-            setattr(self, key, value)
-        self.devices: list[Device] = [
-            device for device in self.manager.devices.values() if device.id in self]
+            if key != 'devices':
+                setattr(self, key, value)
+
+    @property
+    def devices(self) -> list[Device]:
+        return self.manager.topology.tag_devices(self.name)
 
     def __contains__(self, device_id: int):
-        return self.manager.devices[device_id].is_tagged(self)
+        return self.name in self.manager.topology.device_tag_names(device_id)
 
     def is_located(self, location):
         if location is None:
             return False
-        return any([device.location['id'] == location.id for device in self.devices if device.location != None])
+        return self.name in self.manager.topology.location_tag_names(location.id)
 
     @property
     def is_online(self):
-        if len(self.devices) == 0:
-            return TagState.OFFLINE
-
-        num_online_devices = sum(
-            [device.is_online == TagState.ONLINE for device in self.devices])
+        num_online_devices = self.manager.topology.tag_online_counts(self.name)[TagState.ONLINE]
         if num_online_devices == 0:
             return TagState.OFFLINE
-        elif num_online_devices == len(self.devices):
+        elif num_online_devices == len(self.manager.topology.tag_members.get(self.name, {})):
             return TagState.ONLINE
         else:
             return TagState.PARTIAL
 
+    def _roles(self, match: Callable[[str], bool]) -> list[Device]:
+        return [device
+                for role, devices in self.manager.topology.tag_devices_by_role(self.name).items()
+                if match(role)
+                for device in devices.values()]
+
     @property
     def network_switches(self) -> list[Device]:
-        return [device for device in self.devices if device.role == 'Netzwerkswitch']
+        return self._roles(is_network_switch)
 
     @property
     def pdus(self) -> list[Device]:
-        return [device for device in self.devices if device.role == 'PDU']
+        return self._roles(is_pdu)
 
     @property
     def display_devices(self) -> list[Device]:
-        return [device for device in self.devices if device.role in ['Monitor', 'Projektor']]
+        return self._roles(is_display_device)
 
     @property
     def computers(self) -> list[Device]:
-        return [device for device in self.devices if 'Medienstation' in device.role]
+        return self._roles(is_computer)
 
     @property
     def other_devices(self) -> list[Device]:
-        return [device for device in self.devices if device not in [*self.network_switches, *self.pdus, *self.display_devices, *self.computers]]
-
-    async def call(self, devices, method_name):
-        devices = [d for d in devices if method_name in d.capabilities]
-        async with asyncio.TaskGroup() as tg:
-            for device in devices:
-                tg.create_task(getattr(device, method_name)())
-                await asyncio.sleep(random.random())
-        if len(devices):
-            logger.debug('%s %s for %s', self.name,
-                         method_name, [d.name for d in devices])
-
-    async def wait_for(self, devices, *states, timeout=None):
-        if timeout is None:
-            timeout = max([max(device.timeouts.values())
-                          for device in devices])
-        try:
-            async with asyncio.timeout(timeout):
-                async with asyncio.TaskGroup() as tg:
-                    [tg.create_task(d.wait_for(*states)) for d in devices]
-        except Exception as e:
-            logger.exception(e)
-
-    async def call_and_wait_for(self, devices, method_name, *states):
-        await self.call(devices, method_name)
-        try:
-            timeout = max([device.timeouts[method_name]
-                          for device in devices if method_name in device.timeouts])
-        except:
-            timeout = 300
-        await self.wait_for(devices, *states, timeout=timeout)
+        return self._roles(is_other_device)
+
+    def plan(self) -> PowerPlan:
+        return PowerPlan(f'Tag {self.name}', self.devices, self.manager.limiter)
 
     async def wake(self, **__):
-        method_name = 'wake'
-        state = DeviceState.ON
-        if len(self.pdus):
-            await self.call_and_wait_for(self.pdus, method_name, state)
-            logger.debug('Tag %s PDUs are ON', self.name)
-        if len(self.network_switches):
-            await self.call_and_wait_for(self.network_switches, method_name, state)
-            logger.debug('Tag %s Network Switches are ON', self.name)
-        if len(self.display_devices):
-            await self.call_and_wait_for(self.display_devices, method_name, state)
-            logger.debug('Tag %s Display Devices are ON', self.name)
-        if len(self.computers):
-            await self.call(self.computers, method_name)
-            logger.debug('Tag %s Waking computers', self.name)
-        if len(self.other_devices):
-            await self.call(self.other_devices, method_name)
-            logger.debug('Tag %s Waking other devices', self.name)
+        await self.plan().wake()
 
     async def shutdown(self, **__):
-        method_name = 'shutdown'
-        if len(self.computers):
-            await self.call_and_wait_for(self.computers, method_name, DeviceState.OFF)
-            logger.debug('Tag %s Computers are OFF', self.name)
-        if len(self.display_devices):
-            await self.call_and_wait_for(self.display_devices, method_name, DeviceState.OFF, DeviceState.PARTIAL)
-            logger.debug('Tag %s Display devices are OFF', self.name)
-        if len(self.other_devices):
-            await self.call(self.other_devices, method_name)
-            logger.debug('Tag %s Shutdown other devices', self.name)
-        if len(self.network_switches):
-            await self.call(self.network_switches, method_name)
-            logger.debug('Tag %s Shutdown Network Switches', self.name)
-        if len(self.pdus):
-            await self.call(self.pdus, method_name)
-            logger.debug('Tag %s Shutdown PDUs', self.name)
+        await self.plan().shutdown()
 
     async def cancel(self, **__):
         for device in self.devices:
@@ -151,9 +98,10 @@ class Tag:
             if from_knx and self.has_calendar_event and self.last_calendar_method == 'shutdown':
                 return
             logger.debug('%s tag %s', __name, self.name)
-            for device in self.devices:
-                if __name in device.capabilities:
-                    await getattr(device, __name)(**kwargs)
+            devices = [device for device in self.devices if __name in device.capabilities]
+            for batch in self.manager.limiter.batches(devices):
+                await asyncio.sleep(self.manager.limiter.reserve(batch[0]))
+                await asyncio.gather(*[getattr(device, __name)(**kwargs) for device in batch])
         return method
 
     async def fetch(self):
@@ -168,21 +116,23 @@ class Tag:
 
     async def scram(self, **__):
         logger.error('BMZ Scram %s', self.name)
+        plan = self.plan()
         mutable = [
             device for device in self.computers if 'mute' in device._capabilities]
-        await self.call(mutable, 'mute')
+        await plan.call(mutable, 'mute')
         other = [
             device for device in self.computers if 'mute' not in device._capabilities]
 
-        await self.call_and_wait_for(other, 'shutdown', DeviceState.OFF)
-        await self.call(self.display_devices, 'shutdown')
+        await plan.call_and_wait_for(other, 'shutdown', DeviceState.OFF)
+        await plan.call(self.display_devices, 'shutdown')
 
     async def unscram(self, **__):
         logger.error('BMZ Unscram %s', self.name)
+        plan = self.plan()
         unmutable = [
             device for device in self.devices if 'unmute' in device._capabilities]
         other = [
             device for device in self.devices if 'unmute' not in device._capabilities]
-        await self.call(unmutable, 'unmute')
-        await self.call_and_wait_for(self.display_devices, 'wake', DeviceState.ON)
-        await self.call_and_wait_for(other, 'wake', DeviceState.ON)
+        await plan.call(unmutable, 'unmute')
+        await plan.call_and_wait_for(self.display_devices, 'wake', DeviceState.ON)
+        await plan.call_and_wait_for(other, 'wake', DeviceState.ON)
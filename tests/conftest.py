@@ -0,0 +1,18 @@
+import os
+import sys
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('PDU_COMMUNITYSTRING', 'public')
+os.environ.setdefault('PJLINK_PASSWORD', 'secret')
+os.environ.setdefault('API_HOSTNAME', 'localhost')
+
+_workdir = tempfile.mkdtemp(prefix='manager-tests-')
+os.makedirs(os.path.join(_workdir, 'config'))
+shutil.copyfile(os.path.join(ROOT, 'config', 'default_config.yml'),
+                os.path.join(_workdir, 'config', 'config.yml'))
+os.chdir(_workdir)
@@ -0,0 +1,81 @@
+import asyncio
+
+from aiohttp import web
+
+import manager
+from manager import Api
+
+
+class StubServer:
+    def __init__(self):
+        self.token = 'token-1'
+        self.logins = 0
+        self.requests = []
+        self.failures = 0
+        self.app = web.Application()
+        self.app.router.add_post('/auth/jwt/login', self.login)
+        self.app.router.add_get('/api/devices', self.devices)
+
+    async def login(self, request):
+        form = await request.post()
+        assert (form['username'], form['password']) == ('system', 'password')
+        self.logins += 1
+        self.token = f'token-{self.logins}'
+        return web.json_response({'access_token': self.token})
+
+    async def devices(self, request):
+        self.requests.append(request.headers.copy())
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=503)
+        if request.headers.get('authorization') != f'Bearer {self.token}':
+            return web.Response(status=401)
+        if request.headers.get('if-none-match') == '"v1"':
+            return web.Response(status=304)
+        return web.json_response([{'id': 1}], headers={'etag': '"v1"'})
+
+    async def __aenter__(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, *_):
+        await self.runner.cleanup()
+
+
+def test_api(monkeypatch):
+    monkeypatch.setenv('API_SYSTEM_USERNAME', 'system')
+    monkeypatch.setenv('API_SYSTEM_PASSWORD', 'password')
+    monkeypatch.setattr(manager, 'backoff', lambda attempt: 0)
+
+    async def run():
+        async with StubServer() as server:
+            api = Api(api_url=server.url, retries=3)
+            try:
+                assert await api.get('/api/devices', conditional=True) == [{'id': 1}]
+                assert server.logins == 1
+                assert await api.get('/api/devices', conditional=True) is None
+                assert server.requests[-1]['if-none-match'] == '"v1"'
+                assert await api.get('/api/devices') == [{'id': 1}]
+
+                server.failures = 2
+                assert await api.get('/api/devices') == [{'id': 1}]
+                server.failures = 3
+                try:
+                    await api.get('/api/devices')
+                except Exception as e:
+                    assert getattr(e, 'status', None) == 503
+                else:
+                    assert False, 'expected the last failure to be raised'
+
+                server.token = 'rotated'
+                assert await api.get('/api/devices') == [{'id': 1}]
+                assert server.logins == 2
+            finally:
+                await api.close()
+
+    asyncio.run(run())
@@ -0,0 +1,145 @@
+import re
+import asyncio
+import hashlib
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import devices
+import devices.brightsign
+from devices.brightsign import BrightSignClient, DigestAuth
+from devices.state import DeviceState
+from manager import Manager
+
+USER = 'admin'
+PASSWORD = 'avm'
+REALM = 'BrightSign'
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+class StubPlayer:
+    def __init__(self):
+        self.nonce = 'nonce1'
+        self.passwords = {USER: PASSWORD}
+        self.challenges = []
+        self.requests = []
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self
+
+    async def __aexit__(self, *_):
+        await self.runner.cleanup()
+        await devices.brightsign.get_session().close()
+
+    def verify(self, request: web.Request) -> str | None:
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Digest '):
+            return None
+        params = {key: quoted or plain
+                  for key, quoted, plain in re.findall(r'(\w+)=(?:"([^"]*)"|([^,\s]*))', header)}
+        if params.get('opaque') != 'opaque' or params.get('qop') != 'auth':
+            return None
+        ha1 = md5(f'{params["username"]}:{REALM}:{self.passwords.get(params["username"], "")}')
+        ha2 = md5(f'{request.method}:{request.path_qs}')
+        expected = md5(f'{ha1}:{params["nonce"]}:{params["nc"]}:{params["cnonce"]}:auth:{ha2}')
+        if params.get('response') != expected:
+            return None
+        return params['nonce']
+
+    def challenge(self, is_stale: bool) -> web.Response:
+        self.challenges.append(is_stale)
+        header = f'Digest realm="{REALM}", nonce="{self.nonce}", qop="auth-int, auth", opaque="opaque"'
+        if is_stale:
+            header += ', stale=true'
+        return web.Response(status=401, headers={'WWW-Authenticate': header})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        nonce = self.verify(request)
+        if nonce is None:
+            return self.challenge(False)
+        if nonce != self.nonce:
+            return self.challenge(True)
+        self.requests.append((request.method, request.path))
+        match request.path:
+            case '/api/v1/info':
+                return web.json_response({'data': {'result': {'FWVersion': '8.5.47', 'upTimeSeconds': 42}}})
+            case '/api/v1/health':
+                return web.json_response({'data': {'result': {'status': 'active'}}})
+            case '/api/v1/control/reboot':
+                return web.json_response({'data': {'result': {'success': True}}})
+        return web.Response(status=404)
+
+
+def test_digest_auth():
+    async def run():
+        async with StubPlayer() as player:
+            client = BrightSignClient('127.0.0.1', DigestAuth(USER, PASSWORD), base_url=player.url)
+            assert await client.request('GET', '/api/v1/info') == {'FWVersion': '8.5.47', 'upTimeSeconds': 42}
+            assert await client.request('PUT', '/api/v1/control/reboot') == {'success': True}
+            assert player.challenges == [False]
+
+            player.nonce = 'nonce2'
+            assert await client.request('GET', '/api/v1/health') == {'status': 'active'}
+            assert player.challenges == [False, True]
+            assert client.auth.challenges['127.0.0.1']['nc'] == 1
+
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.request('GET', '/api/v1/missing')
+
+    asyncio.run(run())
+
+
+def test_wrong_password():
+    async def run():
+        async with StubPlayer() as player:
+            client = BrightSignClient('127.0.0.1', DigestAuth(USER, 'wrong'), base_url=player.url)
+            with pytest.raises(PermissionError):
+                await client.request('GET', '/api/v1/info')
+            assert player.challenges == [False, False]
+            assert player.requests == []
+
+            player.passwords[USER] = 'wrong'
+            assert await client.request('GET', '/api/v1/health') == {'status': 'active'}
+            assert player.challenges == [False, False]
+
+    asyncio.run(run())
+
+
+def test_status():
+    events = []
+
+    async def callback(*args):
+        events.append(args[-2:])
+
+    async def run():
+        async with StubPlayer() as player:
+            player_device = devices.BrightSign(Manager(None), None, callback, id=1, name='player', tags=[],
+                                               location=None, power_ports=[],
+                                               primary_ip={'address': '127.0.0.1/8', 'dns_name': 'player.example'})
+            player_device.http = BrightSignClient('127.0.0.1', DigestAuth(USER, PASSWORD), base_url=player.url)
+            await player_device._watch_status(scheduled=True)
+            assert player.requests == []
+
+            await player_device.set_is_online(DeviceState.ON)
+            await player_device._watch_status(scheduled=True)
+            assert player_device._state['firmware'] == '8.5.47'
+            assert player_device._state['uptime'] == 42
+            assert player_device._state['health'] == 'active'
+            assert ('health', 'active') in events
+
+            await player_device.reboot()
+            assert player.requests[-1] == ('PUT', '/api/v1/control/reboot')
+
+    asyncio.run(run())
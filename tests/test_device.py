@@ -0,0 +1,59 @@
+import time
+import asyncio
+
+from devices import Device
+from misc import CallState, memoize
+
+
+async def callback(*_):
+    pass
+
+
+class Poller(Device):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.intervals['watch'] = 60
+        self._state['should_wake'] = False
+        self.runs = 0
+
+    async def set_should_wake(self, value: bool):
+        self._state['should_wake'] = value
+
+    @memoize('watch')
+    async def _watch(self):
+        self.runs += 1
+
+
+def make_poller() -> Poller:
+    return Poller(None, None, callback, id=1, name='device1', tags=[], location=None)
+
+
+def test_cancel_keeps_memoize_state():
+    async def run():
+        device = make_poller()
+        await device._watch()
+        device.call_states['timeout_wake'] = CallState()
+        await device.set_should_wake(True)
+        await device.cancel()
+        assert not device._state['should_wake']
+        assert 'timeout_wake' not in device.call_states
+        await device._watch()
+        assert device.runs == 1
+
+    asyncio.run(run())
+
+
+def test_benchmark():
+    async def run():
+        device = make_poller()
+        await device._watch()
+        count = 100000
+        start_time = time.perf_counter()
+        for _ in range(count):
+            await device._watch()
+        return (time.perf_counter() - start_time) / count, device.runs
+
+    per_call, runs = asyncio.run(run())
+    print(f'\nskipped memoized call: {per_call * 1e6:.2f}us')
+    assert runs == 1
+    assert per_call < 1e-4
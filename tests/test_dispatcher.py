@@ -0,0 +1,116 @@
+import asyncio
+
+from dispatcher import Dispatcher
+from devices.icmp import PingCache
+
+
+class StubClient:
+    def __init__(self):
+        self.published = []
+
+    async def publish_json(self, topic, payload):
+        self.published.append((topic, payload))
+
+
+class StubEngine:
+    async def ping(self, address, timeout=None):
+        await asyncio.sleep(0)
+        return True
+
+
+def test_report_includes_ping_stats():
+    async def run():
+        cache = PingCache(StubEngine())
+        await asyncio.gather(*[cache.ping('10.0.0.1') for _ in range(3)])
+        await cache.ping('10.0.0.1')
+        client = StubClient()
+        dispatcher = Dispatcher(workers=2)
+        task = asyncio.create_task(
+            dispatcher.report(client, interval=0, sources={'ping': cache.stats}))
+        while not client.published:
+            await asyncio.sleep(0)
+        task.cancel()
+        return client.published[0]
+
+    topic, payload = asyncio.run(run())
+    assert topic == 'manager/dispatcher'
+    assert payload['workers'] == 2
+    assert payload['ping'] == {'hits': 1, 'coalesced': 2, 'misses': 1}
+
+
+def test_per_key_ordering():
+    async def run():
+        dispatcher = Dispatcher(workers=4)
+        dispatcher.start()
+        handled = []
+
+        async def handle(key, i):
+            await asyncio.sleep(0.001 * (5 - i))
+            handled.append((key, i))
+
+        for i in range(5):
+            for key in ['a', 'b', 'c']:
+                await dispatcher.submit(key, handle, key, i)
+        await asyncio.gather(*[queue.join() for queue in dispatcher.queues])
+        dispatcher.cancel()
+        return handled
+
+    handled = asyncio.run(run())
+    for key in ['a', 'b', 'c']:
+        assert [i for k, i in handled if k == key] == list(range(5))
+
+
+def test_keys_run_in_parallel():
+    async def run():
+        dispatcher = Dispatcher(workers=2)
+        dispatcher.start()
+        blocked = asyncio.Event()
+        handled = []
+
+        async def block():
+            await blocked.wait()
+
+        async def handle():
+            handled.append(1)
+
+        await dispatcher.submit(0, block)
+        await dispatcher.submit(1, handle)
+        async with asyncio.timeout(1):
+            while not handled:
+                await asyncio.sleep(0)
+        blocked.set()
+        dispatcher.cancel()
+
+    asyncio.run(run())
+
+
+def test_backpressure():
+    async def run():
+        dispatcher = Dispatcher(workers=1, maxsize=2)
+        dispatcher.start()
+        blocked = asyncio.Event()
+
+        async def block():
+            await blocked.wait()
+
+        await dispatcher.submit('a', block)
+        await asyncio.sleep(0)
+        await dispatcher.submit('a', block)
+        await dispatcher.submit('a', block)
+        assert dispatcher.backpressure == 0
+        submit = asyncio.create_task(dispatcher.submit('a', block))
+        await asyncio.sleep(0)
+        assert dispatcher.backpressure == 1
+        assert not submit.done()
+        blocked.set()
+        await submit
+        await dispatcher.queues[0].join()
+        stats = dispatcher.stats()
+        dispatcher.cancel()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats['processed'] == 4
+    assert stats['max_depth'] == 2
+    assert stats['backpressure'] == 1
+    assert stats['depth'] == 0
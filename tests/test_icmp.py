@@ -0,0 +1,70 @@
+import time
+import socket
+import asyncio
+
+import pytest
+
+from devices.icmp import PingEngine, PingCache, echo_request
+
+
+def raw_socket_available() -> bool:
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP).close()
+    except OSError:
+        return False
+    return True
+
+
+requires_raw_socket = pytest.mark.skipif(
+    not raw_socket_available(), reason='raw ICMP sockets need CAP_NET_RAW')
+
+
+def test_random_identifier():
+    identifiers = {PingEngine().identifier for _ in range(16)}
+    assert len(identifiers) > 1
+
+
+@requires_raw_socket
+def test_loopback():
+    async def run():
+        engine = PingEngine(timeout=1)
+        try:
+            assert await engine.ping('127.0.0.1')
+            assert await engine.ping_many(['127.0.0.1', '127.0.0.2']) == {
+                '127.0.0.1': True, '127.0.0.2': True}
+
+            engine._outbox.append((('127.0.0.1', 0xffff),
+                                   echo_request(engine.identifier, 0xffff, engine.payload)))
+            sent = engine.sent
+            assert await engine.ping('127.0.0.1')
+            assert engine.sent == sent + 1
+            assert not engine._outbox and not engine._pending
+
+            cache = PingCache(engine)
+            results = await asyncio.gather(*[cache.ping('127.0.0.1') for _ in range(5)])
+            assert all(results)
+            assert await cache.ping('127.0.0.1')
+            assert cache.stats() == {'hits': 1, 'coalesced': 4, 'misses': 1}
+        finally:
+            engine.close()
+
+    asyncio.run(run())
+
+
+@requires_raw_socket
+def test_benchmark():
+    async def run(count: int):
+        engine = PingEngine(timeout=5)
+        try:
+            await engine.ping('127.0.0.1')
+            addresses = [f'127.0.{i // 250}.{i % 250 + 1}' for i in range(count)]
+            start_time = time.perf_counter()
+            results = await engine.ping_many(addresses)
+            return time.perf_counter() - start_time, results
+        finally:
+            engine.close()
+
+    count = 1000
+    duration, results = asyncio.run(run(count))
+    print(f'\n{count} pings in {duration * 1000:.1f}ms ({count / duration:.0f}/s)')
+    assert all(results.values())
@@ -0,0 +1,32 @@
+from limiter import CommandLimiter
+
+
+class Outlet:
+    def __init__(self, id: int, pdu: str):
+        self.id = id
+        self.power_ports = [{'link_peers': [{'power_panel': {'name': pdu}, 'name': str(id)}]}]
+
+
+def test_configure_keeps_buckets():
+    limiter = CommandLimiter(rate=10, burst=2, group_by='pdu')
+    device = Outlet(1, 'pdu1')
+    assert [limiter.reserve(device) for _ in range(2)] == [0, 0]
+    limiter.configure(rate=10, burst=2, group_by='pdu')
+    assert limiter.reserve(device) > 0
+    limiter.configure(rate=20, burst=1, group_by='pdu')
+    bucket = limiter.buckets['pdu1']
+    assert (bucket.rate, bucket.burst) == (20, 1)
+    assert limiter.reserve(device) > 0
+    limiter.configure(rate=20, burst=1, group_by='subnet')
+    assert limiter.buckets == {}
+
+
+class Device:
+    power_ports = None
+
+
+def test_batches_by_pdu():
+    outlets = [Outlet(id, f'pdu{id % 2}') for id in range(4)]
+    devices = [Device(), Device()]
+    batches = CommandLimiter().batches([*outlets, *devices])
+    assert batches == [[outlets[0], outlets[2]], [outlets[1], outlets[3]], [devices[0]], [devices[1]]]
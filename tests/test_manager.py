@@ -0,0 +1,232 @@
+import asyncio
+
+import devices
+from devices.snmp import SnmpPDU, TRAP_V2
+from misc import read_snapshot, write_snapshot
+import manager as manager_module
+from manager import Manager
+
+
+async def callback(*_):
+    pass
+
+
+def make_device(manager: Manager, id: int, device_class=devices.Device, address='10.0.0.5', **kwargs):
+    return device_class(manager, None, callback,
+                        id=id,
+                        name=f'device{id}',
+                        tags=[],
+                        location=None,
+                        device_role={'name': 'PDU'},
+                        device_type={'model': 'Expert 8031-1'},
+                        primary_ip={'address': f'{address}/24', 'dns_name': f'device{id}.example'},
+                        **kwargs)
+
+
+def test_shared_address_routing():
+    async def run():
+        manager = Manager(None)
+        pdus = [make_device(manager, id, devices.GudePDU) for id in [1, 2]]
+        projector = make_device(manager, 3, devices.PJLink)
+        other = make_device(manager, 4, devices.GudePDU, address='10.0.0.6')
+        received = []
+        for device in [*pdus, projector, other]:
+            device.on_trap = lambda varbinds, device=device: received.append((device.id, varbinds))
+            device.on_notification = lambda message, device=device: received.append((device.id, message))
+            manager.index_device(device)
+        assert manager.devices_by_ip['10.0.0.5'] == {*pdus, projector}
+
+        manager.on_trap(SnmpPDU(1, b'public', TRAP_V2, 1, 0, 0, []), ('10.0.0.5', 162))
+        assert sorted(received) == [(1, []), (2, [])]
+        received.clear()
+        manager.on_trap(SnmpPDU(1, b'private', TRAP_V2, 1, 0, 0, []), ('10.0.0.5', 162))
+        assert received == []
+        manager.on_pjlink_notification('%2POWR=1', ('10.0.0.5', 4352))
+        assert received == [(3, '%2POWR=1')]
+
+        manager.unindex_device(pdus[0])
+        assert manager.devices_by_ip['10.0.0.5'] == {pdus[1], projector}
+        manager.unindex_device(other)
+        assert '10.0.0.6' not in manager.devices_by_ip
+
+    asyncio.run(run())
+
+
+class StubClient:
+    def __init__(self):
+        self.published = []
+
+    async def publish_json(self, topic, payload):
+        self.published.append((topic, payload))
+
+
+class FailingClient:
+    async def publish_json(self, topic, payload):
+        raise ConnectionError(topic)
+
+
+class StubApi:
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.modified = True
+
+    async def get(self, path, conditional=False):
+        if conditional and not self.modified:
+            return None
+        return self.inventory
+
+
+def make_inventory(count: int):
+    return {
+        'devices': [{'id': id, 'name': f'device{id}', 'tags': [], 'location': None}
+                    for id in range(count)],
+        'tags': [],
+        'locations': []
+    }
+
+
+def test_inventory_failure_isolated(monkeypatch, tmp_path):
+    config = {'device_map': {}, 'device_options': {}}
+    monkeypatch.setattr(manager_module, 'get_config', lambda: dict(config))
+    monkeypatch.setattr(manager_module, 'SNAPSHOT_PATH', str(tmp_path / 'snapshot.json.gz'))
+
+    async def run():
+        manager = Manager(StubClient())
+        manager.api = StubApi(make_inventory(10))
+        subscribe_device = manager.subscribe_device
+        failing = {4}
+
+        async def flaky_subscribe_device(device):
+            if device['id'] in failing:
+                raise RuntimeError(f'device {device["id"]} failed')
+            await subscribe_device(device)
+        manager.subscribe_device = flaky_subscribe_device
+
+        await manager.setup(initial=True)
+        assert sorted(manager.devices) == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+        assert 4 not in manager.fingerprints['devices']
+        assert manager.client.published[-1][1]['devices']['failed'] == 1
+
+        failing.clear()
+        manager.api.modified = False
+        await manager.setup()
+        assert sorted(manager.devices) == list(range(10))
+        assert manager.client.published[-1][1]['devices'] == {
+            'added': 1, 'changed': 0, 'removed': 0, 'failed': 0}
+
+        published = len(manager.client.published)
+        await manager.setup()
+        assert len(manager.client.published) == published
+
+        config['device_options'] = {'Device': {'offline_count_threshold': 5}}
+        await manager.setup()
+        assert manager.client.published[-1][1]['devices']['changed'] == 10
+        assert all(device.offline_count_threshold == 5 for device in manager.devices.values())
+
+    asyncio.run(run())
+
+
+def test_snapshot_rollback(monkeypatch, tmp_path, caplog):
+    config = {'device_map': {}, 'device_options': {}}
+    snapshot_path = tmp_path / 'snapshot.json.gz'
+    monkeypatch.setattr(manager_module, 'get_config', lambda: dict(config))
+    monkeypatch.setattr(manager_module, 'SNAPSHOT_PATH', str(snapshot_path))
+
+    async def run():
+        manager = Manager(StubClient())
+        manager.api = StubApi(make_inventory(3))
+        await manager.setup(initial=True)
+        assert snapshot_path.exists()
+
+        snapshot = read_snapshot(str(snapshot_path))
+        snapshot['states']['1'] = ['corrupt']
+        write_snapshot(str(snapshot_path), snapshot)
+        manager = Manager(StubClient())
+        manager.api = StubApi(make_inventory(3))
+        manager.config = config
+        manager.device_map = config['device_map']
+        assert not await manager.load_snapshot()
+        assert manager.fingerprints == {}
+
+        await manager.setup(initial=True)
+        assert sorted(manager.devices) == [0, 1, 2]
+        assert manager.client.published[-1][1]['devices']['added'] == 3
+
+        manager = Manager(FailingClient())
+        manager.api = StubApi(make_inventory(3))
+        await manager.setup(initial=True)
+        assert sorted(manager.devices) == [0, 1, 2]
+        await asyncio.wait([manager.tasks['setup']])
+        assert 'setup' not in manager.tasks
+
+    with caplog.at_level('ERROR'):
+        asyncio.run(run())
+    assert any(record.message == 'Inventory refresh failed' for record in caplog.records)
+
+
+def test_refresh_single_flight(monkeypatch, tmp_path):
+    config = {'device_map': {}, 'device_options': {}}
+    monkeypatch.setattr(manager_module, 'get_config', lambda: dict(config))
+    monkeypatch.setattr(manager_module, 'SNAPSHOT_PATH', str(tmp_path / 'snapshot.json.gz'))
+
+    class BlockingApi(StubApi):
+        def __init__(self, inventory):
+            super().__init__(inventory)
+            self.released = asyncio.Event()
+            self.calls = 0
+
+        async def get(self, path, conditional=False):
+            self.calls += 1
+            await self.released.wait()
+            return await super().get(path, conditional)
+
+    async def run():
+        manager = Manager(StubClient())
+        manager.api = BlockingApi(make_inventory(3))
+        for _ in range(3):
+            manager.refresh()
+        await asyncio.sleep(0)
+        assert manager.api.calls == 1
+        manager.api.released.set()
+        while 'setup' in manager.tasks:
+            await asyncio.wait([manager.tasks['setup']])
+        assert manager.api.calls == 2
+        assert sorted(manager.devices) == [0, 1, 2]
+
+    asyncio.run(run())
+
+
+def test_refresh_gives_up(monkeypatch, tmp_path, caplog):
+    config = {'device_map': {}, 'device_options': {}}
+    snapshot_path = tmp_path / 'snapshot.json.gz'
+    monkeypatch.setattr(manager_module, 'get_config', lambda: dict(config))
+    monkeypatch.setattr(manager_module, 'SNAPSHOT_PATH', str(snapshot_path))
+    monkeypatch.setattr(manager_module, 'backoff', lambda attempt: 0)
+
+    class FailingApi:
+        def __init__(self):
+            self.calls = 0
+
+        async def get(self, path, conditional=False):
+            self.calls += 1
+            raise ConnectionError(path)
+
+    async def run():
+        manager = Manager(StubClient(), refresh_attempts=3)
+        manager.api = StubApi(make_inventory(3))
+        await manager.setup(initial=True)
+        published = len(manager.client.published)
+        snapshot = snapshot_path.read_bytes()
+
+        manager.api = FailingApi()
+        async with asyncio.timeout(1):
+            await manager.setup()
+        assert manager.api.calls == 3
+        assert sorted(manager.devices) == [0, 1, 2]
+        assert manager.inventory == make_inventory(3)
+        assert len(manager.client.published) == published
+        assert snapshot_path.read_bytes() == snapshot
+
+    with caplog.at_level('ERROR'):
+        asyncio.run(run())
+    assert any('keeping the last inventory' in record.message for record in caplog.records)
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+
+import devices
+import devices.pjlink
+from devices.pjlink import PJLinkSession, listen_notifications
+from devices.state import DeviceState
+from manager import Manager
+
+PASSWORD = 'secret'
+
+
+class Simulator:
+    def __init__(self, close_after: int | None = None):
+        self.close_after = close_after
+        self.power = '0'
+        self.connects = 0
+        self.commands = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *_):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _warm_up(self):
+        await asyncio.sleep(.1)
+        self.power = '1'
+
+    def respond(self, command: str, param: str) -> str:
+        match command, param:
+            case '1POWR', '?':
+                return self.power
+            case '1POWR', '1':
+                if self.power == '0':
+                    self.power = '3'
+                    asyncio.get_running_loop().create_task(self._warm_up())
+                return 'OK'
+            case '1POWR', '0':
+                self.power = '0'
+                return 'OK'
+            case '1ERST', '?':
+                return '021000'
+            case '1LAMP', '?':
+                return '1234 1'
+            case '1CLSS', '?':
+                return '2'
+            case '2IRES', '?':
+                return '1920x1080'
+        return 'ERR1'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connects += 1
+        token = f'{self.connects:08x}'
+        expected = hashlib.md5((token + PASSWORD).encode()).hexdigest()
+        writer.write(f'PJLINK 1 {token}\r'.encode())
+        handled = 0
+        try:
+            while True:
+                line = (await reader.readuntil(b'\r')).decode()[:-1]
+                if handled == 0:
+                    if not line.startswith(expected):
+                        writer.write(b'PJLINK ERRA\r')
+                        return
+                    line = line[len(expected):]
+                command, _, param = line[1:].partition(' ')
+                self.commands.append(command)
+                writer.write(f'%{command}={self.respond(command, param)}\r'.encode())
+                await writer.drain()
+                handled += 1
+                if self.close_after is not None and handled >= self.close_after:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def test_session_reuses_connection():
+    async def run():
+        async with Simulator() as simulator:
+            session = PJLinkSession('127.0.0.1', PASSWORD, timeout=1, port=simulator.port)
+            for _ in range(3):
+                assert not await session.run(lambda interface: interface.power.get())
+            assert simulator.connects == 1
+            assert session.round_trips_per_minute == 4
+            await session.close()
+
+    asyncio.run(run())
+
+
+def test_session_reconnects_after_close():
+    async def run():
+        async with Simulator(close_after=2) as simulator:
+            session = PJLinkSession('127.0.0.1', PASSWORD, timeout=1, port=simulator.port)
+            for _ in range(3):
+                errors = await session.run(lambda interface: interface.errors.query())
+                assert len(errors) == 6
+            assert simulator.connects == 3
+            await session.close()
+
+    asyncio.run(run())
+
+
+async def callback(*_):
+    pass
+
+
+def make_projector(manager: Manager, port: int, callback=callback) -> devices.PJLink:
+    projector = devices.PJLink(manager, None, callback, id=1, name='projector', tags=[], location=None,
+                               primary_ip={'address': '127.0.0.1/8', 'dns_name': 'projector.example'}, power_ports=[],
+                               watch_interval=.05, wake_interval=.5, connection_timeout=1)
+    projector.session = PJLinkSession('127.0.0.1', PASSWORD, timeout=1, port=port)
+    manager.devices[projector.id] = projector
+    manager.index_device(projector)
+    return projector
+
+
+async def ping_address(_):
+    return True
+
+
+def test_projector(monkeypatch):
+    monkeypatch.setattr(devices.pjlink, 'ping_address', ping_address)
+
+    async def run():
+        async with Simulator() as simulator:
+            manager = Manager(None)
+            projector = make_projector(manager, simulator.port)
+            manager.scheduler.start()
+            manager.scheduler.add_device(projector)
+
+            await projector.wake()
+            async with asyncio.timeout(2):
+                await projector.wait_for(DeviceState.ON)
+                while not projector._state['ires'] or not projector._state['errors']:
+                    await asyncio.sleep(.01)
+            assert projector._state['errors']['lamp'] == 'error'
+            assert projector._state['errors']['temperature'] == 'warn'
+            assert projector._state['lamps'] == [(1234, 1)]
+            assert projector._state['ires'] == '1920x1080'
+            assert simulator.connects == 1
+
+            received = []
+            transport = await listen_notifications(
+                lambda message, address: received.append(message) or manager.on_pjlink_notification(message, address),
+                port=0, host='127.0.0.1')
+            sender, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=transport.get_extra_info('sockname'))
+            simulator.power = '0'
+            sender.sendto(b'%2POWR=0\r')
+            async with asyncio.timeout(2):
+                await projector.wait_for(DeviceState.PARTIAL)
+            assert received == ['%2POWR=0']
+            assert projector.is_pushing
+            sender.close()
+            transport.close()
+            manager.scheduler.remove_device(projector)
+            await projector.cancel()
+            await projector.session.close()
+
+    asyncio.run(run())
+
+
+def test_notification_matches_poll():
+    events = []
+
+    async def record(*args):
+        events.append(args[-2:])
+
+    async def run():
+        async with Simulator() as simulator:
+            projector = make_projector(Manager(None), simulator.port, record)
+            await projector.set_is_online(DeviceState.ON)
+            await projector._apply_notification('%2ERST=021000')
+            await projector._watch_errors(scheduled=True)
+            await projector._apply_notification('%2ERST=021000')
+            await projector._apply_notification('%2ERST=02x000')
+            await projector._apply_notification('%2POWR=9')
+            assert projector.is_online == DeviceState.ON
+            await projector._apply_notification('%2POWR=2')
+            assert projector.is_online == DeviceState.PARTIAL
+            await projector.session.close()
+
+    asyncio.run(run())
+    errors = [value for key, value in events if key == 'errors']
+    assert len(errors) == 1
+    assert errors[0]['lamp'] == 'error'
+    assert errors[0]['temperature'] == 'warn'
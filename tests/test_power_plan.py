@@ -0,0 +1,238 @@
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+import devices
+from devices.state import DeviceState
+import power_plan
+from limiter import CommandLimiter
+from manager import Manager
+from power_plan import PowerPlan
+
+
+async def callback(*_):
+    pass
+
+
+class FakeDevice:
+    def __init__(self, events: list, id: int, role: str, tags: list[str], pdu: str | None = None,
+                 boot_time: float = .01, is_switched: bool = True):
+        self.events = events
+        self.id = id
+        self.name = f'device{id}'
+        self.role = role
+        self.tags = [{'name': tag} for tag in tags]
+        self.capabilities = ['wake', 'shutdown']
+        self.timeouts = {'wake': 2, 'shutdown': 2}
+        self.boot_time = boot_time
+        self.is_switched = is_switched
+        self.state = DeviceState.OFF
+        self.changed = asyncio.Event()
+        if pdu is not None:
+            self.power_ports = [{'link_peers': [{'power_panel': {'name': pdu}, 'name': '1'}]}]
+
+    async def set_power(self, state: bool, wait=False):
+        self.events.append(('outlet', self.name))
+        return self.is_switched
+
+    async def _boot(self):
+        await asyncio.sleep(self.boot_time)
+        self.state = DeviceState.ON
+        self.changed.set()
+
+    async def wake(self):
+        self.events.append(('wake', self.name))
+        asyncio.get_running_loop().create_task(self._boot())
+
+    async def shutdown(self):
+        self.events.append(('shutdown', self.name))
+        self.state = DeviceState.OFF
+        self.changed.set()
+
+    async def wait_for(self, *states):
+        while self.state not in states:
+            self.changed.clear()
+            await self.changed.wait()
+
+
+class Outlet:
+    def __init__(self, switched: list, id: int, pdu: str):
+        self.switched = switched
+        self.id = id
+        self.pdu = pdu
+        self.power_ports = [{'link_peers': [{'power_panel': {'name': pdu}, 'name': str(id)}]}]
+
+    async def set_power(self, state: bool, wait=False):
+        self.switched.append((time.monotonic(), self.pdu))
+        return True
+
+
+def make_devices(events: list) -> list[FakeDevice]:
+    pdu = FakeDevice(events, 1, 'PDU', ['a', 'b'], is_switched=False)
+    pdu.name = 'pdu'
+    return [
+        pdu,
+        FakeDevice(events, 2, 'Netzwerkswitch', ['a'], 'pdu'),
+        FakeDevice(events, 3, 'Netzwerkswitch', ['b'], 'pdu', boot_time=.1),
+        FakeDevice(events, 4, 'Medienstation', ['a'], 'pdu'),
+        FakeDevice(events, 5, 'Monitor', ['a'], 'pdu'),
+        FakeDevice(events, 6, 'Medienstation', ['b']),
+    ]
+
+
+def test_wake_switches_outlets_once(monkeypatch):
+    monkeypatch.setattr(power_plan, 'POWER_SETTLE_TIME', .2)
+    events = []
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay, *args):
+        if delay == power_plan.POWER_SETTLE_TIME:
+            sleeps.append(delay)
+        return await sleep(delay, *args)
+    monkeypatch.setattr(power_plan.asyncio, 'sleep', recording_sleep)
+
+    async def run():
+        devices = make_devices(events)
+        await PowerPlan('test', devices, CommandLimiter(rate=100, burst=100)).wake()
+        return devices
+
+    devices = asyncio.run(run())
+    assert sleeps == [.2]
+    assert events[0] == ('wake', 'pdu')
+    outlets = [event for event in events if event[0] == 'outlet']
+    assert sorted(outlets) == [('outlet', f'device{id}') for id in range(2, 6)]
+    assert events.index(outlets[-1]) < events.index(('wake', 'device2'))
+    assert events.index(('wake', 'device3')) < events.index(('wake', 'device6'))
+    assert all(device.state == DeviceState.ON for device in devices[:3])
+
+
+def test_shutdown_reverses_dependencies():
+    events = []
+
+    async def run():
+        devices = make_devices(events)
+        for device in devices:
+            device.state = DeviceState.ON
+        await PowerPlan('test', devices, CommandLimiter(rate=100, burst=100)).shutdown()
+
+    asyncio.run(run())
+    order = [name for kind, name in events if kind == 'shutdown']
+    assert order[-1] == 'pdu'
+    assert order.index('device6') < order.index('device3')
+    assert order.index('device4') < order.index('device2')
+
+
+def test_outlets_rate_limited_per_pdu():
+    switched = []
+    devices = [Outlet(switched, id, f'pdu{id % 4}') for id in range(16)]
+    plan = PowerPlan('test', devices, CommandLimiter(rate=20, burst=1))
+    start_time = time.monotonic()
+    assert asyncio.run(plan.power_outlets(devices, True))
+    times = {}
+    for switch_time, pdu in switched:
+        times.setdefault(pdu, []).append(switch_time - start_time)
+    assert all(len(pdu_times) == 4 and max(pdu_times) - min(pdu_times) < .01 for pdu_times in times.values())
+    starts = sorted(min(pdu_times) for pdu_times in times.values())
+    assert starts[-1] >= 3 / 20 - .01
+    assert starts[-1] < 5 / 20
+
+
+class StubSnmpClient:
+    def __init__(self):
+        self.sets = []
+
+    async def set(self, messages):
+        self.sets.append(messages)
+        return [SimpleNamespace(value=value) for _, value in messages]
+
+
+def test_outlets_coalesce_per_pdu():
+    async def run():
+        manager = Manager(None)
+        pdu = devices.GudePDU(manager, None, callback, id=100, name='pdu', tags=[], location=None,
+                              device_type={'model': 'Expert 8031-1'},
+                              primary_ip={'address': '127.0.0.1/8', 'dns_name': 'pdu.example'})
+        pdu.snmp_client = StubSnmpClient()
+        pdu._state['powerfeeds'] = [False] * pdu.num_powerfeeds
+        manager.devices_by_name[pdu.name] = pdu
+        members = [devices.WOLable(manager, None, callback, id=id, name=f'device{id}', tags=[], location=None,
+                                   primary_ip={'address': f'127.0.0.{id + 2}/8', 'dns_name': f'device{id}.example'},
+                                   power_ports=[{'link_peers': [{'power_panel': {'name': pdu.name}, 'name': str(id)}]}])
+                   for id in range(pdu.num_powerfeeds)]
+        plan = PowerPlan('test', members, manager.limiter)
+        assert await plan.power_outlets(members, True)
+        assert pdu.powerfeeds == [True] * pdu.num_powerfeeds
+        return pdu.snmp_client.sets
+
+    sets = asyncio.run(run())
+    assert len(sets) == 1
+    assert len(sets[0]) == 8
+
+
+
+async def fan_out_wake(tags: list[list[FakeDevice]], jitter: float):
+    async def call(devices):
+        async with asyncio.TaskGroup() as tg:
+            for device in devices:
+                tg.create_task(device.wake())
+                await asyncio.sleep(random.random() * jitter)
+
+    async def call_and_wait_for(devices):
+        await call(devices)
+        async with asyncio.TaskGroup() as tg:
+            for device in devices:
+                tg.create_task(device.wait_for(DeviceState.ON))
+
+    async def wake_tag(devices):
+        for role in ['PDU', 'Netzwerkswitch', 'Monitor']:
+            await call_and_wait_for([device for device in devices if device.role == role])
+        await call([device for device in devices if device.role == 'Medienstation'])
+
+    async with asyncio.TaskGroup() as tg:
+        for devices in tags:
+            tg.create_task(wake_tag(devices))
+
+
+def make_location(events: list, count: int) -> list[list[FakeDevice]]:
+    pdu = FakeDevice(events, 0, 'PDU', [], boot_time=.05, is_switched=False)
+    pdu.name = 'pdu'
+    switch = FakeDevice(events, 1, 'Netzwerkswitch', [], 'pdu', boot_time=.3, is_switched=False)
+    tags = []
+    for i in range(count):
+        tag = f'element{i}'
+        pdu.tags.append({'name': tag})
+        switch.tags.append({'name': tag})
+        members = [FakeDevice(events, 10 * i + j, 'Monitor', [tag], 'pdu', boot_time=.3, is_switched=False)
+                   for j in range(2, 4)]
+        members += [FakeDevice(events, 10 * i + j, 'Medienstation', [tag], 'pdu', boot_time=.6, is_switched=False)
+                    for j in range(4, 7)]
+        tags.append([pdu, switch, *members])
+    return tags
+
+
+def test_benchmark_location_wake():
+    jitter = .01
+
+    async def run(wake) -> tuple[float, int]:
+        events = []
+        tags = make_location(events, 4)
+        devices = list({device.id: device for devices in tags for device in devices}.values())
+        start_time = time.perf_counter()
+        await wake(tags, devices)
+        async with asyncio.timeout(5):
+            for device in devices:
+                await device.wait_for(DeviceState.ON)
+        return time.perf_counter() - start_time, len([event for event in events if event[0] == 'wake'])
+
+    async def merged_wake(_, devices):
+        await PowerPlan('location', devices, CommandLimiter(rate=4 / jitter, burst=4)).wake()
+
+    fan_out, fan_out_calls = asyncio.run(run(lambda tags, _: fan_out_wake(tags, jitter)))
+    merged, merged_calls = asyncio.run(run(merged_wake))
+    print(f'\nlocation wake: per-tag fan-out {fan_out:.2f}s ({fan_out_calls} wake calls), '
+          f'merged plan {merged:.2f}s ({merged_calls} wake calls)')
+    assert merged_calls == 22
+    assert fan_out_calls == 28
+    assert merged < fan_out
@@ -0,0 +1,133 @@
+import json
+import time
+import random
+import asyncio
+
+from aiomqtt import Topic
+
+from router import Router
+
+
+def make_router(calls: list) -> Router:
+    router = Router()
+
+    def handler(name):
+        async def handle(segments, data):
+            calls.append((name, segments, data))
+        return handle
+
+    router.add('probe/+/+', handler('probe'), parse_json=False)
+    router.add('api/data-refresh', handler('refresh'))
+    router.add('api/device/+', handler('device'))
+    router.add('calendar/+/+/+', handler('calendar'))
+    router.add('knx/#', handler('knx'))
+    return router
+
+
+def test_match():
+    calls = []
+    router = make_router(calls)
+
+    async def run():
+        assert await router.dispatch('probe/host.example/power', b'on')
+        assert await router.dispatch('api/device/wake', '{"data": {"id": 1}}')
+        assert await router.dispatch('knx/switch/3', '{}')
+        assert await router.dispatch('knx', '{}')
+        assert await router.dispatch('api/data-refresh', 'not json')
+        assert not await router.dispatch('api/device', '{}')
+        assert not await router.dispatch('probe/host.example', b'')
+
+    asyncio.run(run())
+    assert calls == [
+        ('probe', ['probe', 'host.example', 'power'], 'on'),
+        ('device', ['api', 'device', 'wake'], {'data': {'id': 1}}),
+        ('knx', ['knx', 'switch', '3'], {}),
+        ('knx', ['knx'], {}),
+        ('refresh', ['api', 'data-refresh'], {}),
+    ]
+
+
+def test_exact_before_wildcard():
+    calls = []
+    router = make_router(calls)
+    special = lambda *_: None
+    router.add('api/device/special', special)
+    assert router.resolve('api/device/special')[0].handler is special
+    assert router.resolve('api/device/other')[0].handler is not special
+
+
+def baseline_dispatch(topic: Topic, payload: bytes):
+    if topic.matches('probe/#'):
+        _, fqdn, device_method = topic.value.split('/')
+        payload.decode()
+        return
+    try:
+        payload = json.loads(payload)
+    except:
+        payload = {}
+    if topic.matches('api/data-refresh'):
+        return
+    if topic.matches('api/subscribe_devices'):
+        return
+    if topic.matches('api/device/+'):
+        topic.value.split('/')[2]
+        return
+    if topic.matches('api/tag/+'):
+        topic.value.split('/')[2]
+        return
+    if topic.matches('api/location/+'):
+        topic.value.split('/')[2]
+        return
+    if topic.matches('calendar/#'):
+        topic.value.split('/')[1]
+        topic.value.split('/')[2]
+        topic.value.split('/')[3]
+        return
+    if topic.matches('knx/switch/#'):
+        int(topic.value.split('/')[2])
+    if topic.matches('fac/#'):
+        topic.value.split('/')[1]
+        topic.value.split('/')[2]
+
+
+def message_mix(count: int) -> list[tuple[str, bytes]]:
+    rng = random.Random(1)
+    templates = [
+        (60, lambda i: (f'probe/host{i % 500}.example/ping', b'1')),
+        (15, lambda i: (f'probe/host{i % 500}.example/fans',
+                        json.dumps({'cpu': rng.randint(800, 2400), 'case': rng.randint(600, 1200)}).encode())),
+        (10, lambda i: (f'api/device/{rng.choice(["wake", "shutdown", "reboot"])}',
+                        json.dumps({'data': {'id': i % 2000}, 'params': {}}).encode())),
+        (5, lambda i: ('api/tag/wake', json.dumps({'data': {'id': i % 50}}).encode())),
+        (5, lambda i: ('calendar/start/location/wake',
+                       json.dumps({'data': {'id': i % 80}, 'event': {'summary': 'Opening hours'}}).encode())),
+        (5, lambda i: (f'knx/switch/{i % 80}', json.dumps({'value': i % 2}).encode())),
+    ]
+    weights = [weight for weight, _ in templates]
+    return [rng.choices(templates, weights)[0][1](i) for i in range(count)]
+
+
+def test_benchmark():
+    async def handle(*_):
+        pass
+
+    router = make_router([])
+    for pattern in ['api/subscribe_devices', 'api/tag/+', 'api/location/+', 'fac/+/+']:
+        router.add(pattern, handle)
+    messages = message_mix(20000)
+
+    start_time = time.perf_counter()
+    for topic, payload in messages:
+        baseline_dispatch(Topic(topic), payload)
+    baseline = len(messages) / (time.perf_counter() - start_time)
+
+    async def run() -> float:
+        start_time = time.perf_counter()
+        for topic, payload in messages:
+            assert await router.dispatch(topic, payload)
+        return len(messages) / (time.perf_counter() - start_time)
+
+    routed = asyncio.run(run())
+    print(f'\n{len(messages)} messages: baseline {baseline:,.0f} msg/s, '
+          f'router {routed:,.0f} msg/s ({routed / baseline:.1f}x)')
+    assert routed > baseline
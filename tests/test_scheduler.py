@@ -0,0 +1,72 @@
+import math
+import time
+import asyncio
+
+from misc import memoize
+from scheduler import Scheduler
+
+
+class CoarseLoop(asyncio.SelectorEventLoop):
+    def time(self):
+        return math.floor(super().time() * 1000) / 1000
+
+
+class Poller:
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.intervals = {'watch': interval}
+        self.call_states = {}
+        self.tasks = {}
+        self.runs = 0
+        self.update_methods = [('Watch', self._watch)]
+
+    @memoize('watch')
+    async def _watch(self):
+        self.runs += 1
+
+    def run_update(self, name, method, **kwargs):
+        return asyncio.get_running_loop().create_task(method(**kwargs))
+
+
+async def run_fleet(size: int, interval: float, duration: float):
+    scheduler = Scheduler()
+    scheduler.start()
+    devices = [Poller(f'device{i}', interval) for i in range(size)]
+    for device in devices:
+        scheduler.add_device(device)
+    await asyncio.sleep(duration)
+    for device in devices:
+        scheduler.remove_device(device)
+    return scheduler, devices
+
+
+def test_scheduled_calls_bypass_memoize():
+    loop = CoarseLoop()
+    try:
+        scheduler, devices = loop.run_until_complete(run_fleet(4, 0.01, 0.12))
+    finally:
+        loop.close()
+    assert scheduler.fired >= 20
+    assert sum(device.runs for device in devices) == scheduler.fired
+
+
+def test_memoize_gates_unscheduled_calls():
+    async def run():
+        device = Poller('device', 60)
+        await device._watch()
+        await device._watch()
+        await device._watch(scheduled=True)
+        return device.runs
+    assert asyncio.run(run()) == 2
+
+
+def test_benchmark():
+    interval, duration = 0.5, 1.5
+    for size in [100, 1000, 5000]:
+        start_time = time.process_time()
+        scheduler, devices = asyncio.run(run_fleet(size, interval, duration))
+        cpu_time = time.process_time() - start_time
+        print(f'\n{size} devices: {scheduler.fired} fires, '
+              f'{cpu_time * 100 / duration:.1f}% CPU, {cpu_time * 1e6 / scheduler.fired:.1f}us/fire')
+        assert sum(device.runs for device in devices) == scheduler.fired
+        assert scheduler.fired >= size * (duration / interval - 1)
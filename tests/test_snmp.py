@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+import devices
+from devices.snmp import (GET_BULK_REQUEST, GET_REQUEST, GET_RESPONSE, SEQUENCE, SET_REQUEST, TRAP_V2,
+                          SnmpClient, SnmpEngine, SnmpError, decode_message, encode_integer,
+                          encode_message, encode_oid, encode_tlv, encode_value, listen_traps)
+
+PORT_STATE_OID = '1.3.6.1.4.1.28507.81.1.3.1.2.1.3'
+
+
+class Agent(asyncio.DatagramProtocol):
+    def __init__(self, community: str = 'public', drop: int = 0):
+        self.community = community
+        self.drop = drop
+        self.state = {f'{PORT_STATE_OID}.{i}': i % 2 for i in range(1, 9)}
+        self.requests = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def respond(self, request, varbinds, error_status=0, error_index=0):
+        encoded_varbinds = b''.join(encode_tlv(SEQUENCE, encode_oid(oid) + encode_value(value))
+                                    for oid, value in varbinds)
+        pdu = encode_tlv(GET_RESPONSE, encode_integer(request.request_id)
+                         + encode_integer(error_status) + encode_integer(error_index)
+                         + encode_tlv(SEQUENCE, encoded_varbinds))
+        return encode_tlv(SEQUENCE, encode_integer(1) + encode_value(request.community) + pdu)
+
+    def datagram_received(self, data, addr):
+        request = decode_message(data)
+        self.requests.append(request.type)
+        if self.drop:
+            self.drop -= 1
+            return
+        if request.community != self.community.encode():
+            return
+        error_status = error_index = 0
+        if request.type == GET_REQUEST:
+            varbinds = []
+            for i, (oid, _) in enumerate(request.varbinds):
+                if oid not in self.state:
+                    error_status, error_index = 2, i + 1
+                varbinds.append((oid, self.state.get(oid)))
+        elif request.type == GET_BULK_REQUEST:
+            prefix = request.varbinds[0].oid + '.'
+            oids = sorted((oid for oid in self.state if oid.startswith(prefix)),
+                          key=lambda oid: int(oid.rsplit('.', 1)[1]))
+            varbinds = [(oid, self.state[oid]) for oid in oids[:request.error_index]]
+        elif request.type == SET_REQUEST:
+            for oid, value in request.varbinds:
+                self.state[oid] = value
+            varbinds = request.varbinds
+        self.transport.sendto(self.respond(request, varbinds, error_status, error_index), addr)
+
+
+async def start_agent(**kwargs) -> tuple[Agent, int]:
+    transport, agent = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: Agent(**kwargs), local_addr=('127.0.0.1', 0))
+    return agent, transport.get_extra_info('sockname')[1]
+
+
+def test_encode_integer():
+    assert encode_integer(0) == b'\x02\x01\x00'
+    assert encode_integer(128) == b'\x02\x02\x00\x80'
+    assert encode_integer(-129) == b'\x02\x02\xff\x7f'
+
+
+def test_client():
+    async def run():
+        agent, port = await start_agent(drop=1)
+        engine = SnmpEngine(local_addr=('127.0.0.1', 0))
+        client = SnmpClient(engine, '127.0.0.1', 'public', timeout=.2, retries=1, port=port)
+        try:
+            result = await client.get([f'{PORT_STATE_OID}.1', f'{PORT_STATE_OID}.2'])
+            assert [(varbind.oid, varbind.value) for varbind in result] == [
+                (f'{PORT_STATE_OID}.1', 1), (f'{PORT_STATE_OID}.2', 0)]
+            assert agent.requests == [GET_REQUEST, GET_REQUEST]
+            assert client.latency is not None
+
+            result = await client.get_bulk([PORT_STATE_OID], max_repetitions=8)
+            assert [varbind.value for varbind in result] == [1, 0, 1, 0, 1, 0, 1, 0]
+
+            await client.set([(f'{PORT_STATE_OID}.2', 1)])
+            assert agent.state[f'{PORT_STATE_OID}.2'] == 1
+
+            results = await asyncio.gather(*[client.get([f'{PORT_STATE_OID}.{i}']) for i in range(1, 9)])
+            assert [result[0].value for result in results] == [1, 1, 1, 0, 1, 0, 1, 0]
+
+            with pytest.raises(SnmpError):
+                await client.get(['1.3.6.1.2.1.1.1.0'])
+            with pytest.raises(TimeoutError):
+                await SnmpClient(engine, '127.0.0.1', 'private', timeout=.1, retries=1, port=port).get(
+                    [f'{PORT_STATE_OID}.1'])
+            assert not engine._pending
+        finally:
+            engine.close()
+            agent.transport.close()
+
+    asyncio.run(run())
+
+
+async def callback(*_):
+    pass
+
+
+def test_gude_pdu():
+    async def run():
+        agent, port = await start_agent()
+        engine = SnmpEngine(local_addr=('127.0.0.1', 0))
+        pdu = devices.GudePDU(None, None, callback, id=1, name='pdu', tags=[], location=None,
+                              device_type={'model': 'Expert 8031-1'},
+                              primary_ip={'address': '127.0.0.1/8', 'dns_name': 'pdu.example'},
+                              write_coalesce_window=.01)
+        pdu.snmp_client = SnmpClient(engine, '127.0.0.1', 'public', timeout=.5, port=port)
+        try:
+            await pdu._read_powerfeeds()
+            assert pdu.powerfeeds == [True, False] * 4
+            assert pdu.use_bulk and agent.requests == [GET_BULK_REQUEST]
+
+            futures = [await pdu.write_powerfeed(1, True), await pdu.write_powerfeed(3, True)]
+            assert await asyncio.gather(*futures) == [True, True]
+            assert agent.requests.count(SET_REQUEST) == 1
+            assert pdu.powerfeeds == [True, True, True, True, True, False, True, False]
+        finally:
+            engine.close()
+            agent.transport.close()
+
+    asyncio.run(run())
+
+
+def test_traps():
+    async def run():
+        received = []
+        transport = await listen_traps(lambda pdu, addr: received.append(pdu), port=0, host='127.0.0.1')
+        port = transport.get_extra_info('sockname')[1]
+        sender, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=('127.0.0.1', port))
+        try:
+            sender.sendto(encode_message('public', TRAP_V2, 7, [(f'{PORT_STATE_OID}.3', 0)]))
+            sender.sendto(b'garbage')
+            sender.sendto(encode_message('public', GET_REQUEST, 8, [(f'{PORT_STATE_OID}.3', None)]))
+            while not received:
+                await asyncio.sleep(.01)
+            await asyncio.sleep(.05)
+        finally:
+            sender.close()
+            transport.close()
+        assert len(received) == 1
+        assert received[0].community == b'public'
+        assert [(varbind.oid, varbind.value) for varbind in received[0].varbinds] == [
+            (f'{PORT_STATE_OID}.3', 0)]
+
+    asyncio.run(run())
@@ -0,0 +1,167 @@
+import time
+import random
+import asyncio
+
+from devices.state import DeviceState
+from manager import Manager
+
+TAG_NAMES = [f'tag{i}' for i in range(8)]
+LOCATION_IDS = list(range(4))
+
+
+def make_device(rng: random.Random, id: int) -> dict:
+    location_id = rng.choice([None, *LOCATION_IDS])
+    return {
+        'id': id,
+        'name': f'device{id}',
+        'tags': [{'name': name} for name in rng.sample(TAG_NAMES, rng.randint(0, 3))],
+        'location': None if location_id is None else {'id': location_id},
+        'device_role': {'name': rng.choice(['PDU', 'Netzwerkswitch', 'Monitor', 'Medienstation'])}
+    }
+
+
+def make_inventory(rng: random.Random, count: int) -> dict:
+    return {
+        'devices': [make_device(rng, id) for id in range(count)],
+        'tags': [{'id': i, 'name': name, 'description': 'Element'}
+                 for i, name in enumerate(TAG_NAMES)],
+        'locations': [{'id': id, 'name': f'location{id}'} for id in LOCATION_IDS]
+    }
+
+
+async def make_manager(inventory: dict) -> Manager:
+    manager = Manager(None)
+    manager.config = {'device_map': {}, 'device_options': {}}
+    manager.device_map = {}
+    await manager.apply_inventory(**inventory)
+    return manager
+
+
+def recompute(devices: list) -> int:
+    num_online_devices = sum(device.is_online == DeviceState.ON for device in devices)
+    if num_online_devices == 0:
+        return 0
+    elif num_online_devices == len(devices):
+        return 2
+    return 1
+
+
+def assert_consistent(manager: Manager):
+    devices = list(manager.devices.values())
+    for tag in manager.tags.values():
+        members = [device for device in devices if tag.name in {t['name'] for t in device.tags}]
+        assert tag.is_online == recompute(members), tag.name
+    for location in manager.locations.values():
+        members = [device for device in devices
+                   if device.location is not None and device.location['id'] == location.id]
+        assert location.is_online == recompute(members), location.id
+
+
+def test_online_counts_match_recompute():
+    rng = random.Random(12)
+
+    async def run():
+        manager = await make_manager(make_inventory(rng, 60))
+        assert_consistent(manager)
+        devices = list(manager.devices.values())
+        for _ in range(2000):
+            device = rng.choice(devices)
+            value = rng.choice([DeviceState.OFF, DeviceState.PARTIAL, DeviceState.ON])
+            if rng.random() < .5:
+                device._transition(value)
+            else:
+                device.restore_state({'is_online': value})
+            assert_consistent(manager)
+
+    asyncio.run(run())
+
+
+def assert_topology(manager: Manager):
+    topology = manager.topology
+    devices = list(manager.devices.values())
+    assert topology.devices == manager.devices
+    for tag_name in TAG_NAMES:
+        members = [device for device in devices if tag_name in {t['name'] for t in device.tags}]
+        counts = [0, 0, 0]
+        for device in members:
+            counts[device.is_online] += 1
+        assert topology.tag_online_counts(tag_name) == counts
+        assert {device.id for device in topology.tag_devices(tag_name)} == {device.id for device in members}
+        roles = {role: set(role_members) for role, role_members in topology.tag_devices_by_role(tag_name).items()}
+        expected_roles = {}
+        for device in members:
+            expected_roles.setdefault(device.role, set()).add(device.id)
+        assert roles == expected_roles
+    for location_id in LOCATION_IDS:
+        members = [device for device in devices
+                   if device.location is not None and device.location['id'] == location_id]
+        counts = [0, 0, 0]
+        for device in members:
+            counts[device.is_online] += 1
+        assert topology.location_online_counts(location_id) == counts
+        assert sorted(topology.location_tag_names(location_id)) == sorted(
+            {t['name'] for device in members for t in device.tags})
+
+
+def mutate(rng: random.Random, inventory: dict, next_id: int) -> int:
+    devices = inventory['devices']
+    for _ in range(rng.randint(1, 5)):
+        action = rng.random()
+        if action < .3 and devices:
+            devices.pop(rng.randrange(len(devices)))
+        elif action < .6:
+            devices.append(make_device(rng, next_id))
+            next_id += 1
+        elif devices:
+            index = rng.randrange(len(devices))
+            devices[index] = make_device(rng, devices[index]['id'])
+    return next_id
+
+
+def test_topology_matches_recompute():
+    rng = random.Random(13)
+
+    async def run():
+        inventory = make_inventory(rng, 40)
+        next_id = len(inventory['devices'])
+        manager = await make_manager(inventory)
+        for _ in range(300):
+            if rng.random() < .2:
+                next_id = mutate(rng, inventory, next_id)
+                await manager.apply_inventory(**inventory)
+            else:
+                for device in rng.sample(list(manager.devices.values()), min(5, len(manager.devices))):
+                    device._transition(rng.choice([DeviceState.OFF, DeviceState.PARTIAL, DeviceState.ON]))
+            assert_topology(manager)
+            assert_consistent(manager)
+
+    asyncio.run(run())
+
+
+def test_benchmark():
+    rng = random.Random(10000)
+
+    async def run():
+        start_time = time.perf_counter()
+        manager = await make_manager(make_inventory(rng, 10000))
+        setup_time = time.perf_counter() - start_time
+        devices = list(manager.devices.values())
+        transitions = [(rng.choice(devices), rng.choice([DeviceState.OFF, DeviceState.ON]))
+                       for _ in range(100000)]
+        start_time = time.perf_counter()
+        for device, value in transitions:
+            device._transition(value)
+        transition_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for _ in range(100):
+            for tag in manager.tags.values():
+                tag.is_online
+            for location in manager.locations.values():
+                location.is_online
+        status_time = time.perf_counter() - start_time
+        return setup_time, transition_time / len(transitions), status_time / 100
+
+    setup_time, per_transition, per_status = asyncio.run(run())
+    print(f'\n10000 devices: setup {setup_time:.2f}s, transition {per_transition * 1e6:.2f}us, '
+          f'all tag and location states {per_status * 1e6:.1f}us')
+    assert per_transition < 1e-4
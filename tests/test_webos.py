@@ -0,0 +1,164 @@
+import os
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from devices.state import DeviceState
+import devices.tv
+import devices.webos
+from devices.webos import WebOSClient, WebOSCredentialStore, WebOSError
+from manager import Manager
+
+
+class FakeTV:
+    def __init__(self, client_key: str = 'KEY1'):
+        self.client_key = client_key
+        self.registrations = []
+        self.has_power_state = True
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'ws://127.0.0.1:{port}/'
+        return self
+
+    async def __aexit__(self, *_):
+        await self.runner.cleanup()
+        await devices.webos.get_session().close()
+
+    async def send(self, ws: web.WebSocketResponse, id: str, type: str = 'response', **message):
+        await ws.send_str(json.dumps({'id': id, 'type': type, **message}))
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            data = json.loads(message.data)
+            id = data['id']
+            match data['type'], data.get('uri'):
+                case 'register', _:
+                    self.registrations.append(data['payload'].get('client-key'))
+                    await self.send(ws, id, payload={'pairingType': 'PROMPT'})
+                    await asyncio.sleep(.05)
+                    await self.send(ws, id, 'registered', payload={'client-key': self.client_key})
+                case 'subscribe', 'ssap://com.webos.service.tvpower/power/getPowerState' if self.has_power_state:
+                    for state in ['Active', 'Screen Off', 'Suspend']:
+                        await self.send(ws, id, payload={'state': state})
+                case 'subscribe', _:
+                    await self.send(ws, id, 'error', error='404 no such service')
+                case 'request', 'ssap://system/turnOff':
+                    await self.send(ws, id, payload={'returnValue': True})
+                    await ws.close()
+                case 'request', 'ssap://system/hangUp':
+                    await ws.close()
+                case _:
+                    await self.send(ws, id, 'error', error='404 no such service')
+        return ws
+
+
+def test_register(tmp_path):
+    path = tmp_path / 'weboscreds.json'
+    path.write_text(json.dumps({'client_key': 'LEGACY'}))
+
+    async def run():
+        async with FakeTV() as tv:
+            client = WebOSClient('127.0.0.1', WebOSCredentialStore(str(path)), url=tv.url)
+            await client.connect()
+            await client.register()
+            assert json.loads(path.read_text()) == {'client_key': 'LEGACY', '127.0.0.1': 'KEY1'}
+            modified = os.stat(path).st_mtime_ns
+            await client.register()
+            assert os.stat(path).st_mtime_ns == modified
+            assert tv.registrations == ['LEGACY', 'KEY1']
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_requests_and_subscriptions(tmp_path):
+    async def run():
+        async with FakeTV() as tv:
+            closed = asyncio.Event()
+            client = WebOSClient('127.0.0.1', WebOSCredentialStore(str(tmp_path / 'weboscreds.json')),
+                                 url=tv.url, on_close=closed.set)
+            await client.connect()
+            states = []
+            power_state = await client.subscribe('ssap://com.webos.service.tvpower/power/getPowerState',
+                                                 lambda payload: states.append(payload['state']))
+            unknown = await client.subscribe('ssap://unknown', states.append)
+            with pytest.raises(WebOSError):
+                await client.request('ssap://unknown')
+            assert states == ['Active', 'Screen Off', 'Suspend']
+            assert client.is_subscribed(power_state)
+            assert not client.is_subscribed(unknown)
+
+            assert await client.request('ssap://system/turnOff') == {'returnValue': True}
+            async with asyncio.timeout(1):
+                await closed.wait()
+            assert not client.is_connected
+            assert not client.is_subscribed(power_state)
+            with pytest.raises(ConnectionError):
+                await client.request('ssap://system/turnOff')
+
+    asyncio.run(run())
+
+
+def test_close_wakes_pending_request(tmp_path):
+    async def run():
+        async with FakeTV() as tv:
+            client = WebOSClient('127.0.0.1', WebOSCredentialStore(str(tmp_path / 'weboscreds.json')),
+                                 url=tv.url, timeout=5)
+            await client.connect()
+            with pytest.raises(ConnectionError):
+                async with asyncio.timeout(1):
+                    await client.request('ssap://system/hangUp')
+
+    asyncio.run(run())
+
+
+async def callback(*_):
+    pass
+
+
+def test_tv_ping_fallback(tmp_path, monkeypatch):
+    pings = []
+
+    async def ping_address(address):
+        pings.append(address)
+        return False
+    monkeypatch.setattr(devices.tv, 'ping_address', ping_address)
+
+    async def run():
+        async with FakeTV() as tv:
+            tv.has_power_state = False
+            television = devices.tv.LGWebOSTV(Manager(None), None, callback, id=1, name='tv', tags=[], location=None,
+                                              power_ports=[], offline_count_threshold=0,
+                                              primary_ip={'address': '127.0.0.1/8', 'dns_name': 'tv.example'})
+            television.webosclient = WebOSClient('127.0.0.1', WebOSCredentialStore(str(tmp_path / 'weboscreds.json')),
+                                                 url=tv.url, on_close=television.on_close)
+            await television.try_connect()
+            await television.register_client(scheduled=True)
+            await asyncio.sleep(.05)
+            assert television.is_registered
+            assert television.is_online == DeviceState.ON
+            await television.ping(scheduled=True)
+            assert pings == ['127.0.0.1']
+            assert television.is_online == DeviceState.OFF
+
+            tv.has_power_state = True
+            await television.register_client(scheduled=True)
+            await asyncio.sleep(.05)
+            assert television.is_online == DeviceState.PARTIAL
+            await television.ping(scheduled=True)
+            assert pings == ['127.0.0.1']
+            television.webosclient.on_close = None
+            await television.webosclient.close()
+
+    asyncio.run(run())
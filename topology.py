@@ -0,0 +1,94 @@
+from collections import Counter
+
+from devices import Device
+
+
+class Topology:
+    def __init__(self):
+        self.devices: dict[int, Device] = {}
+        self.device_tags: dict[int, set[str]] = {}
+        self.device_roles: dict[int, str] = {}
+        self.device_location: dict[int, int] = {}
+        self.tag_members: dict[str, dict[int, Device]] = {}
+        self.tag_roles: dict[str, dict[str, dict[int, Device]]] = {}
+        self.tag_counts: dict[str, list[int]] = {}
+        self.location_members: dict[int, dict[int, Device]] = {}
+        self.location_tags: dict[int, Counter] = {}
+        self.location_counts: dict[int, list[int]] = {}
+
+    def add_device(self, device: Device):
+        self.remove_device(device.id)
+        tag_names = {tag['name'] for tag in device.tags}
+        state = device.is_online
+        self.devices[device.id] = device
+        self.device_tags[device.id] = tag_names
+        self.device_roles[device.id] = device.role
+        for tag_name in tag_names:
+            self.tag_members.setdefault(tag_name, {})[device.id] = device
+            self.tag_roles.setdefault(tag_name, {}).setdefault(
+                device.role, {})[device.id] = device
+            self.tag_counts.setdefault(tag_name, [0, 0, 0])[state] += 1
+        if device.location is not None:
+            location_id = device.location['id']
+            self.device_location[device.id] = location_id
+            self.location_members.setdefault(location_id, {})[device.id] = device
+            self.location_counts.setdefault(location_id, [0, 0, 0])[state] += 1
+            self.location_tags.setdefault(location_id, Counter()).update(tag_names)
+
+    def remove_device(self, device_id: int):
+        device = self.devices.pop(device_id, None)
+        if device is None:
+            return
+        state = device.is_online
+        tag_names = self.device_tags.pop(device_id)
+        role = self.device_roles.pop(device_id)
+        for tag_name in tag_names:
+            del self.tag_members[tag_name][device_id]
+            roles = self.tag_roles[tag_name]
+            del roles[role][device_id]
+            if not roles[role]:
+                del roles[role]
+            self.tag_counts[tag_name][state] -= 1
+        location_id = self.device_location.pop(device_id, None)
+        if location_id is not None:
+            del self.location_members[location_id][device_id]
+            self.location_counts[location_id][state] -= 1
+            self.location_tags[location_id].subtract(tag_names)
+            self.location_tags[location_id] += Counter()
+
+    def transition(self, device: Device, previous: int, value: int):
+        if self.devices.get(device.id) is not device:
+            return
+        for tag_name in self.device_tags[device.id]:
+            counts = self.tag_counts[tag_name]
+            counts[previous] -= 1
+            counts[value] += 1
+        location_id = self.device_location.get(device.id)
+        if location_id is not None:
+            counts = self.location_counts[location_id]
+            counts[previous] -= 1
+            counts[value] += 1
+
+    def tag_devices(self, tag_name: str) -> list[Device]:
+        return list(self.tag_members.get(tag_name, {}).values())
+
+    def tag_devices_by_role(self, tag_name: str) -> dict[str, dict[int, Device]]:
+        return self.tag_roles.get(tag_name, {})
+
+    def tag_online_counts(self, tag_name: str) -> list[int]:
+        return self.tag_counts.get(tag_name, [0, 0, 0])
+
+    def location_devices(self, location_id: int) -> list[Device]:
+        return list(self.location_members.get(location_id, {}).values())
+
+    def location_tag_names(self, location_id: int) -> list[str]:
+        return list(self.location_tags.get(location_id, {}))
+
+    def location_online_counts(self, location_id: int) -> list[int]:
+        return self.location_counts.get(location_id, [0, 0, 0])
+
+    def device_tag_names(self, device_id: int) -> set[str]:
+        return self.device_tags.get(device_id, set())
+
+    def device_location_id(self, device_id: int) -> int | None:
+        return self.device_location.get(device_id)